@@ -16,7 +16,9 @@ export function handleRetry(failureCount: number, error: any, retryFn: RetryFn)
     if (!(error instanceof AxiosError)) return failureCount < 3; // unknown error, retry
 
     if (error.status === 500) return failureCount < 3; // server error
-    if (error.status === 504) return true; // gateway timeout
+    if (error.status === 429) return failureCount < 3; // rate limited, back off
+    if (error.status === 503) return failureCount < 3; // server overloaded, back off
+    if (error.status === 504) return failureCount < 3; // gateway timeout
     if (error.code === 'ERR_NETWORK') return true; // preflight request timeout, retry
 
     const res = retryFn(failureCount, error);
@@ -80,9 +82,56 @@ export async function sendMail(props: SendMailProps) {
     return res;
 }
 
+export async function sendMailWithAttachments(props: SendMailProps, files: File[]) {
+    const form = new FormData();
+    form.append('to', props.to);
+    form.append('subject', props.subject);
+    form.append('body', props.body);
+    files.forEach((file) => form.append('attachments', file, file.name));
+
+    console.log(`API - sendMailWithAttachments(${props}, ${files.length})...`);
+    const res = await api.post('/mail', form);
+    console.log(`API - sendMailWithAttachments(${props}, ${files.length}) = ${res}`);
+    return res;
+}
+
+export async function sendMails(mails: SendMailProps[]) {
+    console.log(`API - sendMails(${mails.length})...`);
+    const res = await api.post('/mails', mails);
+    console.log(`API - sendMails(${mails.length}) = ${res}`);
+    return res;
+}
+
 export async function listMails() {
     console.log(`API - listMails()...`);
     const res = await api.get('/mails');
     console.log(`API - listMails() = ${res}`);
     return res;
-}
\ No newline at end of file
+}
+
+export async function getMailStats() {
+    console.log(`API - getMailStats()...`);
+    const res = await api.get('/mails/stats');
+    console.log(`API - getMailStats() = ${res}`);
+    return res;
+}
+
+export async function searchMails(q: string, page = 1, perPage = 20) {
+    console.log(`API - searchMails(${q}, ${page})...`);
+    const res = await api.get('/mails/search', { params: { q, page, per_page: perPage } });
+    console.log(`API - searchMails(${q}, ${page}) = ${res}`);
+    return res;
+}
+
+type MailEvent = 'queued' | 'sent' | 'failed';
+export function subscribeMailEvents(onEvent: (event: MailEvent, data: any) => void) {
+    // EventSource cannot send the Authorization header, the token goes in the query
+    const url = new URL('/events', api.defaults.baseURL);
+    url.searchParams.set('token', localStorage.getItem('token') || '');
+
+    const source = new EventSource(url);
+    for (const event of ['queued', 'sent', 'failed'] as MailEvent[]) {
+        source.addEventListener(event, (e) => onEvent(event, JSON.parse((e as MessageEvent).data)));
+    }
+    return () => source.close();
+}
@@ -0,0 +1,74 @@
+import bson
+import timeit
+
+from app.models import Mail, User
+
+
+def _raw_mail(user_id: bson.ObjectId) -> dict:
+    return {
+        "_id": bson.ObjectId(),
+        "to": "someone@example.com",
+        "subject": "Hello",
+        "body": "Lorem ipsum dolor sit amet. " * 20,
+        "user_id": user_id,
+    }
+
+
+def _raw_user() -> dict:
+    return {
+        "_id": bson.ObjectId(),
+        "username": "someone",
+        "email": "someone@example.com",
+        "hashed_password": "passwordhashed",
+    }
+
+
+def _project(doc: dict) -> dict:
+    """
+    Mimic what MongoDB returns for a find() with `db_projection()`.
+    """
+
+    return {
+        key if key != "_id" else "id": str(value) if isinstance(value, bson.ObjectId) else value
+        for key, value in doc.items()
+    }
+
+
+def run(n_docs: int = 1000, repeat: int = 5) -> None:
+    """
+    Compare the per-document hydration cost of the list endpoints (GET /mails, GET /users)
+    between validating `from_db` and the trusted `db_projection` + `from_trusted_db` path.
+
+    The serialization done by the handlers (`model_dump`) is included in both.
+
+    :param n_docs: The number of documents per list.
+    :param repeat: The number of runs, the best one is reported.
+    """
+
+    user_id = bson.ObjectId()
+    cases = [
+        ("GET /mails", Mail, [_raw_mail(user_id) for _ in range(n_docs)]),
+        ("GET /users", User, [_raw_user() for _ in range(n_docs)]),
+    ]
+
+    for name, model, raw_docs in cases:
+        projected_docs = [_project(doc) for doc in raw_docs]
+
+        def validated():
+            return [model(**model.from_db(doc)).model_dump() for doc in raw_docs]
+
+        def trusted():
+            return [model.from_trusted_db(doc).model_dump() for doc in projected_docs]
+
+        assert validated() == trusted()
+
+        before = min(timeit.repeat(validated, number=1, repeat=repeat)) / n_docs
+        after = min(timeit.repeat(trusted, number=1, repeat=repeat)) / n_docs
+        print(
+            f"{name}: validated {before * 1e6:.2f} us/doc, "
+            f"trusted {after * 1e6:.2f} us/doc ({before / after:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,146 @@
+import time
+import uuid
+import typing
+import threading
+import collections
+
+
+# Sentinel for telling a cached `None` apart from a missing entry.
+MISSING = object()
+
+
+class TTLCache:
+    max_size: int
+    ttl: float
+    hits: int
+    misses: int
+
+    _entries: collections.OrderedDict
+    _lock: threading.Lock
+
+    def __init__(self, max_size: int = 1024, ttl: float = 60.0) -> None:
+        """
+        Create a bounded LRU cache whose entries expire after a fixed time to live.
+
+        :param max_size: The maximum number of entries kept in the cache.
+        :param ttl: The time to live of an entry in seconds.
+        """
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        """
+        Get a value from the cache, counting the lookup as a hit or a miss.
+
+        :param key: The key of the entry.
+        :param default: The value returned when the key is missing or expired.
+
+        :return: The cached value, or `default`.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+            if entry is MISSING:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: typing.Hashable, value: typing.Any) -> None:
+        """
+        Put a value in the cache, evicting the least recently used entry if full.
+
+        :param key: The key of the entry.
+        :param value: The value to cache.
+        """
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: typing.Hashable) -> None:
+        """
+        Remove an entry from the cache if present.
+
+        :param key: The key of the entry.
+        """
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """
+        Remove all entries from the cache. Metrics are kept.
+        """
+
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        """
+        Get the hit/miss metrics of the cache.
+
+        :return: A dictionary with the number of hits, misses and live entries.
+        """
+
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+
+class VersionCounter:
+    """
+    Version numbers per key, bumped on every write to the keyed resource.
+    Versions are prefixed with a per-process nonce so they never repeat across restarts.
+    """
+
+    nonce: str
+
+    _versions: collections.Counter
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.nonce = uuid.uuid4().hex[:8]
+        self._versions = collections.Counter()
+        self._lock = threading.Lock()
+
+    def bump(self, key: typing.Hashable) -> None:
+        """
+        Mark the resource identified by the key as changed.
+
+        :param key: The key of the resource.
+        """
+
+        with self._lock:
+            self._versions[key] += 1
+
+    def get(self, key: typing.Hashable) -> str:
+        """
+        Get the current version of the resource identified by the key.
+
+        :param key: The key of the resource.
+
+        :return: An opaque version string.
+        """
+
+        with self._lock:
+            return f"{self.nonce}-{self._versions[key]}"
@@ -0,0 +1,79 @@
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# The first byte of a compressed value tells which codec produced it.
+# Plain values are stored as strings, so they never need a marker.
+CODEC_ZLIB = b"\x01"
+CODEC_ZSTD = b"\x02"
+
+
+def available_codec(name: str) -> bytes | None:
+    """
+    Resolve a codec name to its marker, falling back to zlib when zstd is not installed.
+
+    :param name: "zstd", "zlib" or "none".
+
+    :return: The marker of the codec, or None if compression is disabled.
+    """
+
+    if name == "none":
+        return None
+    if name == "zstd" and zstandard is not None:
+        return CODEC_ZSTD
+    return CODEC_ZLIB
+
+
+def compress_text(text: str, codec: bytes | None, threshold: int) -> str | bytes:
+    """
+    Compress a text if it is large enough for compression to pay off.
+
+    :param text: The text to compress.
+    :param codec: The marker of the codec to use, None to disable compression.
+    :param threshold: The minimum size in bytes of the encoded text to compress.
+
+    :return: The marker followed by the compressed text, or the text itself if it was
+             too small or did not shrink.
+    """
+
+    if codec is None:
+        return text
+
+    data = text.encode("utf-8")
+    if len(data) < threshold:
+        return text
+
+    if codec == CODEC_ZSTD:
+        compressed = codec + zstandard.ZstdCompressor().compress(data)
+    else:
+        compressed = codec + zlib.compress(data)
+
+    if len(compressed) >= len(data):
+        return text
+    return compressed
+
+
+def decompress_text(value: str | bytes) -> str:
+    """
+    Reverse `compress_text`.
+
+    :param value: A plain text or a marked compressed value.
+
+    :return: The original text.
+    """
+
+    if isinstance(value, str):
+        return value
+
+    codec, payload = value[:1], value[1:]
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd compressed values")
+        return zstandard.ZstdDecompressor().decompress(payload).decode("utf-8")
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(payload).decode("utf-8")
+    raise ValueError(f"Unknown compression codec: {codec!r}")
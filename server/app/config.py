@@ -1,4 +1,5 @@
 import warnings
+from typing import Literal
 
 from pydantic import model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -13,14 +14,55 @@ class Settings(BaseSettings):
     )
 
     SERVER_PORT: int = 6969
+    SERVER_MAX_BODY_SIZE: int = 1024 * 1024
+    # GET /metrics, unauthenticated
+    METRICS_ENABLED: bool = True
+
+    # serve HTTPS when a certificate is given, empty to serve plain HTTP
+    TLS_CERTFILE: str = ""
+    TLS_KEYFILE: str = ""
+    TLS_HANDSHAKE_TIMEOUT: float = 5
+    TLS_NUM_TICKETS: int = 2
+
+    CORS_ALLOWED_ORIGINS: list[str] = ["*"]
+    CORS_MAX_AGE: int = 86400
+
+    # serve the Next.js static export (`next build` with `output: "export"`), empty to disable
+    STATIC_ROOT: str = ""
+    STATIC_MAX_AGE: int = 31536000
+
+    MAX_IN_FLIGHT: int = 256
+    MAX_LOW_PRIORITY_IN_FLIGHT: int = 32
+    RATE_LIMIT_IP_RATE: float = 20
+    RATE_LIMIT_IP_BURST: int = 40
+    RATE_LIMIT_USER_RATE: float = 5
+    RATE_LIMIT_USER_BURST: int = 20
 
     MONGODB_URI: str
     MONGODB_DATABASE: str = "networkingfinal"
+    MONGODB_MAX_POOL_SIZE: int = 100
+    MONGODB_MIN_POOL_SIZE: int = 0
+    MONGODB_WAIT_QUEUE_TIMEOUT_MS: int = 2000
+    MONGODB_WRITE_BATCH_MAX_SIZE: int = 100
+    MONGODB_WRITE_BATCH_DELAY_MS: float = 2.0
+
+    USER_CACHE_ENABLED: bool = True
+    USER_CACHE_MAX_SIZE: int = 1024
+    USER_CACHE_TTL: float = 60.0
 
     MAIL_SERVER: str = "mail.ntust.edu.tw"
     MAIL_PORT: int = 25
     MAIL_USERNAME: str
     MAIL_PASSWORD: str
+    MAIL_TIMEOUT: float = 30
+    MAIL_BATCH_MAX_SIZE: int = 100
+    MAIL_MAX_ATTACHMENTS_SIZE: int = 25 * 1024 * 1024
+    MAIL_SEARCH_MAX_PER_PAGE: int = 100
+    MAIL_BODY_COMPRESSION: Literal["zstd", "zlib", "none"] = "zlib"
+    MAIL_BODY_COMPRESSION_THRESHOLD: int = 1024
+
+    EVENTS_MAX_SUBSCRIBERS: int = 1000
+    EVENTS_HEARTBEAT_INTERVAL: float = 15
 
     LOG_LEVEL: str = "DEBUG"
     LOG_FORMAT: str = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
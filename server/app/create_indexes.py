@@ -0,0 +1,6 @@
+from app import repository
+
+
+if __name__ == "__main__":
+    # build the text index of GET /mails/search, see MongoRepository.create_indexes
+    repository.create_indexes()
@@ -1,10 +1,12 @@
 import bson
 import typing
+import functools
 import logging
 import pymongo
 import pymongo.database
 import pymongo.collection
 import pydantic
+from typing_extensions import Self
 
 
 RequiredId = typing.Annotated[
@@ -36,6 +38,40 @@ class DbDumper(pydantic.BaseModel):
             del model_dump["_id"]
         return model_dump
 
+    @classmethod
+    @functools.cache
+    def db_projection(cls) -> dict:
+        """
+        Build a find() projection that returns documents already shaped like the model:
+        `_id` is renamed to `id` and ObjectId fields (`id` and `*_id`) are converted to
+        strings by the database, so no post-processing is needed in Python.
+
+        :return: The projection, computed once per model class.
+        """
+
+        projection: dict[str, typing.Any] = {"_id": 0}
+        for name in cls.model_fields:
+            if name == "id":
+                projection[name] = {"$toString": "$_id"}
+            elif name.endswith("_id"):
+                projection[name] = {"$toString": f"${name}"}
+            else:
+                projection[name] = 1
+        return projection
+
+    @classmethod
+    def from_trusted_db(cls, doc: dict) -> Self:
+        """
+        Hydrate a model from a document fetched with `db_projection`, skipping validation.
+        Only use this for documents written by this application.
+
+        :param doc: The projected document.
+
+        :return: The model instance.
+        """
+
+        return cls.model_construct(**doc)
+
     @staticmethod
     def to_db(model: pydantic.BaseModel, include_id: bool = False) -> dict:
         dump = model.model_dump(context="objectid")
@@ -49,6 +85,7 @@ class DbDumper(pydantic.BaseModel):
 class Database:
     logger: logging.Logger
 
+    client_class = pymongo.MongoClient
     client: pymongo.MongoClient
     db: pymongo.database.Database
 
@@ -57,6 +94,9 @@ class Database:
         uri: str,
         database_name: str,
         logger: logging.Logger = logging.getLogger(__name__),
+        max_pool_size: int = 100,
+        min_pool_size: int = 0,
+        wait_queue_timeout_ms: int | None = None,
     ):
         """
         Initialize the database connection.
@@ -64,9 +104,17 @@ class Database:
         :param uri: The URI of the MongoDB database.
         :param database_name: The name of the database.
         :param logger: The logger to use.
+        :param max_pool_size: The maximum number of connections in the pool.
+        :param min_pool_size: The number of connections kept open when idle.
+        :param wait_queue_timeout_ms: How long to wait for a free connection, None waits forever.
         """
         self.logger = logger
-        self.client = pymongo.MongoClient(uri)
+        self.client = self.client_class(
+            uri,
+            maxPoolSize=max_pool_size,
+            minPoolSize=min_pool_size,
+            waitQueueTimeoutMS=wait_queue_timeout_ms,
+        )
         self.db = self.client[database_name]
 
     def get_collection(self, collection_name: str) -> pymongo.collection.Collection:
@@ -80,3 +128,12 @@ class Database:
 
         codec_options = bson.CodecOptions(tz_aware=True)
         return self.db.get_collection(collection_name, codec_options=codec_options)
+
+
+class AsyncDatabase(Database):
+    """
+    Same as Database, backed by pymongo's asyncio client. Collection methods return awaitables.
+    """
+
+    client_class = pymongo.AsyncMongoClient
+    client: pymongo.AsyncMongoClient
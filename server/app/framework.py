@@ -1,12 +1,23 @@
+import os
+import ssl
 import json
+import math
+import time
 import typing
+import hashlib
+import urllib.parse
 import socket
+import asyncio
+import inspect
 import logging
+import mimetypes
 import dataclasses
+import email.message
 import collections
 
 
-Handler = typing.Callable[["Ctx", "Request"], "Response"]
+# Handlers and middlewares may also be coroutine functions, they are awaited by `Router.route_async`.
+Handler = typing.Callable[["Ctx", "Request"], typing.Union["Response", typing.Awaitable["Response"]]]
 Ctx = dict[str, typing.Any]
 # Middleware here does not operate like a typical middleware you find in other frameworks:
 #   - it only gets called once before the handler
@@ -17,16 +28,34 @@ Middleware = typing.Callable[["Ctx", "Request"], typing.Optional["Response"]]
 
 Status = collections.namedtuple("Status", ["code", "message"])
 Status_200_OK = Status(200, "OK")
+Status_204_NO_CONTENT = Status(204, "No Content")
+Status_206_PARTIAL_CONTENT = Status(206, "Partial Content")
 Status_302_FOUND = Status(302, "Found")
+Status_304_NOT_MODIFIED = Status(304, "Not Modified")
 Status_400_BAD_REQUEST = Status(400, "Bad Request")
 Status_401_UNAUTHORIZED = Status(401, "Unauthorized")
 Status_403_FORBIDDEN = Status(403, "Forbidden")
 Status_404_NOT_FOUND = Status(404, "Not Found")
 Status_409_CONFLICT = Status(409, "Conflict")
+Status_413_PAYLOAD_TOO_LARGE = Status(413, "Payload Too Large")
+Status_416_RANGE_NOT_SATISFIABLE = Status(416, "Range Not Satisfiable")
+Status_429_TOO_MANY_REQUESTS = Status(429, "Too Many Requests")
 Status_500_INTERNAL_SERVER_ERROR = Status(500, "Internal Server Error")
+Status_503_SERVICE_UNAVAILABLE = Status(503, "Service Unavailable")
 Status_504_GATEWAY_TIMEOUT = Status(504, "Gateway Timeout")
 
 
+@dataclasses.dataclass
+class FileBody:
+    """
+    A slice of a file sent as the response body with `os.sendfile`, never read into memory.
+    """
+
+    path: str
+    offset: int
+    length: int
+
+
 @dataclasses.dataclass
 class Response:
     body: str
@@ -34,6 +63,9 @@ class Response:
     content_type: str
 
     headers: dict[str, str] = dataclasses.field(default_factory=dict)
+    file: FileBody | None = None
+    # long-lived body written chunk by chunk until exhausted or the client leaves, AsyncServer only
+    stream: typing.AsyncIterator[bytes] | None = None
 
     @staticmethod
     def from_json(body: dict, status=Status_200_OK) -> "Response":
@@ -86,6 +118,35 @@ class Response:
             content_type="application/json",
         )
 
+    @staticmethod
+    def retry_later(retry_after: float, status=Status_503_SERVICE_UNAVAILABLE) -> "Response":
+        """
+        Create a new response asking the client to back off, with a "Retry-After" header.
+
+        :param retry_after: The number of seconds the client should wait.
+        :param status: The status of the response, 503 or 429.
+
+        :return: The response object.
+        """
+
+        res = Response.from_text(status.message, status=status)
+        res.set_header("Retry-After", str(max(1, math.ceil(retry_after))))
+        return res
+
+    @staticmethod
+    def not_modified(etag: str) -> "Response":
+        """
+        Create a new 304 response, telling the client its cached copy is still valid.
+
+        :param etag: The ETag of the cached representation.
+
+        :return: The response object.
+        """
+
+        res = Response(body="", status=Status_304_NOT_MODIFIED, content_type="")
+        res.set_etag(etag)
+        return res
+
     def set_header(self, key: str, value: str) -> None:
         """
         Set a header in the response.
@@ -96,6 +157,38 @@ class Response:
 
         self.headers[key] = value
 
+    def add_vary(self, header: str) -> None:
+        """
+        Add a request header to the "Vary" header of the response, keeping the ones already listed.
+
+        :param header: The name of the request header, e.g. "Origin".
+        """
+
+        vary = [value.strip() for value in self.headers.get("Vary", "").split(",") if value.strip()]
+        if header.lower() not in (value.lower() for value in vary):
+            vary.append(header)
+        self.headers["Vary"] = ", ".join(vary)
+
+    def set_etag(self, etag: str | None = None) -> None:
+        """
+        Set the "ETag" header in the response.
+
+        :param etag: The quoted entity tag. If omitted, a hash of the body is used.
+        """
+
+        if etag is None:
+            etag = f'"{hashlib.blake2b(self.body.encode(), digest_size=16).hexdigest()}"'
+        self.headers["ETag"] = etag
+
+    def set_cache_control(self, value: str) -> None:
+        """
+        Set the "Cache-Control" header in the response.
+
+        :param value: The directives, e.g. "private, no-cache" or "public, max-age=3600".
+        """
+
+        self.headers["Cache-Control"] = value
+
     def set_cookie(self, key: str, value: str, expires: int = 60 * 15) -> None:
         """
         Set the "Set-Cookie" header in the response.
@@ -118,28 +211,50 @@ class Response:
         :return: The response as bytes.
         """
 
-        _body = f"HTTP/1.1 {self.status.code} {self.status.message}\r\n"
-        _body += f"Access-Control-Allow-Origin: *\r\n"
-        _body += f"Access-Control-Allow-Credentials: true\r\n"
-        _body += f"Access-Control-Allow-Methods: GET, POST, PUT, PATCH, DELETE, OPTIONS\r\n"
-        _body += f"Access-Control-Allow-Headers: Content-Type, Authorization, Cookie, Set-Cookie, Origin\r\n"
-        _body += f"Content-Type: {self.content_type}\r\n"
-        _body += f"Content-Length: {len(self.body)}\r\n"
+        body = self.body.encode()
+        content_length = self.file.length if self.file else len(body)
+
+        _head = f"HTTP/1.1 {self.status.code} {self.status.message}\r\n"
+        if self.status != Status_304_NOT_MODIFIED:
+            _head += f"Content-Type: {self.content_type}\r\n"
+            if not self.stream:
+                _head += f"Content-Length: {content_length}\r\n"
         for key, value in self.headers.items():
-            _body += f"{key}: {value}\r\n"
-        _body += f"\r\n"
-        _body += f"{self.body}"
-        return _body.encode()
+            _head += f"{key}: {value}\r\n"
+        _head += f"\r\n"
+        return _head.encode() + body
 
     def send(self, connection_socket: socket.socket) -> None:
         """
-        Send the response to the client.
+        Send the response to the client. Streaming responses are sent by `AsyncServer.send_stream`.
 
         :param connection_socket: The socket to send the response to.
         """
 
         connection_socket.sendall(self.to_bytes())
 
+        if self.file:
+            # socket.sendfile uses os.sendfile and copes with the socket timeout
+            with open(self.file.path, "rb") as f:
+                connection_socket.sendfile(f, self.file.offset, self.file.length)
+
+    async def send_async(self, writer: asyncio.StreamWriter) -> None:
+        """
+        Send the response to the client from the event loop.
+
+        :param writer: The stream to send the response to.
+        """
+
+        writer.write(self.to_bytes())
+        await writer.drain()
+
+        if self.file:
+            # falls back to reading and writing the file on TLS connections
+            with open(self.file.path, "rb") as f:
+                await asyncio.get_running_loop().sendfile(
+                    writer.transport, f, self.file.offset, self.file.length
+                )
+
 
 @dataclasses.dataclass
 class Request:
@@ -150,6 +265,9 @@ class Request:
     params: dict[str, str] = dataclasses.field(default_factory=dict)
     headers: dict[str, str] = dataclasses.field(default_factory=dict)
     cookies: dict[str, str] = dataclasses.field(default_factory=dict)
+    client_address: tuple | None = None
+    # set instead of `body` for multipart/form-data requests on AsyncServer, read by the handler
+    multipart: typing.Optional["MultipartReader"] = None
 
     @staticmethod
     def from_bytes(message: bytes) -> "Request":
@@ -166,14 +284,10 @@ class Request:
         _params = dict()
         if "?" in _path:
             _path, _raw_params = _path.split("?", 1)
-            _params = dict([param.split("=") for param in _raw_params.split("&")])
+            _params = dict(urllib.parse.parse_qsl(_raw_params, keep_blank_values=True))
 
         _headers = dict([header.strip().split(": ", 1) for header in _headers])
-
-        if _headers.get("Content-Type", "") == "application/json":
-            _body = json.loads(_body) if _body else None
-        elif _headers.get("Content-Type", "") == "application/x-www-form-urlencoded":
-            _body = dict([param.split("=") for param in _body.split("&")]) if _body else None
+        _body = Request.parse_body(_headers, _body)
 
         _cookies = dict()
         if "Cookie" in _headers:
@@ -191,6 +305,44 @@ class Request:
             cookies=_cookies,
         )
 
+    @staticmethod
+    def parse_body(headers: dict[str, str], body: str) -> typing.Any:
+        """
+        Decode a request body according to its "Content-Type".
+
+        :param headers: The headers of the request.
+        :param body: The raw body.
+
+        :return: The decoded body, or the raw body for other content types.
+        """
+
+        if headers.get("Content-Type", "") == "application/json":
+            return json.loads(body) if body else None
+        elif headers.get("Content-Type", "") == "application/x-www-form-urlencoded":
+            return dict([param.split("=") for param in body.split("&")]) if body else None
+        return body
+
+    def matches_etag(self, etag: str) -> bool:
+        """
+        Check the "If-None-Match" header against an ETag, using weak comparison.
+
+        :param etag: The current ETag of the resource.
+
+        :return: True if the client already has this representation.
+        """
+
+        if_none_match = self.headers.get("If-None-Match")
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+
+        etag = etag.removeprefix("W/")
+        return any(
+            candidate.strip().removeprefix("W/") == etag
+            for candidate in if_none_match.split(",")
+        )
+
     def get_route(self) -> str:
         """
         Get the route name of the request.
@@ -212,17 +364,597 @@ class Request:
         return message
 
 
+class MultipartPart:
+    """
+    One part of a multipart/form-data body, read incrementally from the connection.
+    """
+
+    headers: dict[str, str]
+    name: str | None
+    filename: str | None
+    content_type: str
+
+    multipart: "MultipartReader"
+    finished: bool
+
+    def __init__(self, multipart: "MultipartReader", headers: dict[str, str]) -> None:
+        self.multipart = multipart
+        self.headers = headers
+        self.finished = False
+
+        disposition = email.message.Message()
+        disposition["Content-Disposition"] = headers.get("content-disposition", "")
+        self.name = disposition.get_param("name", header="content-disposition")
+        self.filename = disposition.get_filename()
+        self.content_type = headers.get("content-type", "text/plain")
+
+    async def read_chunk(self) -> bytes:
+        """
+        Read the next chunk of the part.
+
+        :return: The chunk, b"" once the part is exhausted.
+        """
+
+        if self.finished:
+            return b""
+        return await self.multipart._read_part_chunk(self)
+
+    async def read(self, max_size: int) -> bytes:
+        """
+        Read the whole part, meant for small form fields.
+
+        :param max_size: The maximum size of the part, ValueError is raised beyond.
+
+        :return: The content of the part.
+        """
+
+        content = bytearray()
+        while chunk := await self.read_chunk():
+            content += chunk
+            if len(content) > max_size:
+                raise ValueError(f"Part {self.name} is larger than {max_size} bytes")
+        return bytes(content)
+
+
+class MultipartReader:
+    """
+    Streaming multipart/form-data parser. Parts are read from the connection as the handler
+    consumes them, so uploads can be forwarded chunk by chunk instead of buffered.
+
+    Usage:
+    ```python
+    async for part in req.multipart:
+        while chunk := await part.read_chunk():
+            ...
+    ```
+    """
+
+    reader: asyncio.StreamReader
+    delimiter: bytes
+    remaining: int
+    timeout: float
+    chunk_size: int
+
+    buffer: bytearray
+    part: MultipartPart | None
+    done: bool
+
+    def __init__(
+        self,
+        reader: asyncio.StreamReader,
+        boundary: str,
+        content_length: int,
+        timeout: float = 2,
+        chunk_size: int = 64 * 1024,
+    ) -> None:
+        """
+        :param reader: The connection, positioned at the start of the body.
+        :param boundary: The boundary from the "Content-Type" header.
+        :param content_length: The length of the body, never read past.
+        :param timeout: The timeout of each read from the connection.
+        :param chunk_size: The size of the reads from the connection.
+        """
+
+        self.reader = reader
+        self.delimiter = b"\r\n--" + boundary.encode()
+        self.remaining = content_length
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+
+        # the first delimiter has no leading CRLF, pretend it has one
+        self.buffer = bytearray(b"\r\n")
+        self.part = None
+        self.done = False
+
+    @staticmethod
+    def boundary(content_type: str) -> str | None:
+        """
+        Extract the boundary of a multipart/form-data "Content-Type" header.
+
+        :param content_type: The value of the header.
+
+        :return: The boundary, None if it is not multipart/form-data.
+        """
+
+        message = email.message.Message()
+        message["Content-Type"] = content_type
+        if message.get_content_type() != "multipart/form-data":
+            return None
+        return message.get_boundary()
+
+    async def _fill(self) -> None:
+        if self.remaining <= 0:
+            raise ValueError("Malformed multipart body")
+        chunk = await asyncio.wait_for(
+            self.reader.read(min(self.chunk_size, self.remaining)), timeout=self.timeout
+        )
+        if not chunk:
+            raise ValueError("Connection closed in multipart body")
+        self.remaining -= len(chunk)
+        self.buffer += chunk
+
+    async def _read_until(self, separator: bytes) -> bytes:
+        while (index := self.buffer.find(separator)) == -1:
+            if len(self.buffer) > self.chunk_size:
+                raise ValueError("Multipart headers too large")
+            await self._fill()
+        data = bytes(self.buffer[:index])
+        del self.buffer[: index + len(separator)]
+        return data
+
+    async def _read_part_chunk(self, part: MultipartPart) -> bytes:
+        while True:
+            index = self.buffer.find(self.delimiter)
+            if index != -1:
+                data = bytes(self.buffer[:index])
+                del self.buffer[: index + len(self.delimiter)]
+                part.finished = True
+                return data
+
+            # keep a tail that could be the start of the delimiter
+            safe = len(self.buffer) - len(self.delimiter) + 1
+            if safe > 0:
+                data = bytes(self.buffer[:safe])
+                del self.buffer[:safe]
+                return data
+            await self._fill()
+
+    async def next_part(self) -> MultipartPart | None:
+        """
+        Advance to the next part, skipping what is left of the current one.
+
+        :return: The next part, None after the last one.
+        """
+
+        if self.done:
+            return None
+
+        if self.part is None:
+            await self._read_until(self.delimiter)  # skip the preamble
+        else:
+            while await self.part.read_chunk():
+                pass
+
+        while len(self.buffer) < 2:
+            await self._fill()
+        if self.buffer[:2] == b"--":
+            self.done = True
+            return None
+
+        raw_headers = await self._read_until(b"\r\n\r\n")
+        headers = dict()
+        for line in raw_headers.decode(errors="replace").split("\r\n")[1:]:
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        self.part = MultipartPart(self, headers)
+        return self.part
+
+    def __aiter__(self) -> "MultipartReader":
+        return self
+
+    async def __anext__(self) -> MultipartPart:
+        part = await self.next_part()
+        if part is None:
+            raise StopAsyncIteration
+        return part
+
+
+@dataclasses.dataclass
+class Cors:
+    """
+    Cross-origin resource sharing policy of a server.
+
+    Preflight (OPTIONS) requests are answered by the server itself from the request
+    line and the Origin header, without parsing the rest of the request or routing it.
+    The answers are pre-built per origin and cached by browsers for `max_age` seconds.
+    """
+
+    allowed_origins: list[str] = dataclasses.field(default_factory=lambda: ["*"])
+    allowed_methods: list[str] = dataclasses.field(
+        default_factory=lambda: ["GET", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"]
+    )
+    allowed_headers: list[str] = dataclasses.field(
+        default_factory=lambda: [
+            "Content-Type",
+            "Authorization",
+            "Cookie",
+            "Set-Cookie",
+            "Origin",
+            "If-None-Match",
+        ]
+    )
+    allow_credentials: bool = True
+    max_age: int = 86400
+
+    _preflight_responses: dict[str | None, bytes] = dataclasses.field(
+        default_factory=dict, init=False, repr=False
+    )
+
+    @staticmethod
+    def is_preflight(message: bytes) -> bool:
+        """
+        Check whether a raw request is a preflight request, from its request line only.
+
+        :param message: The raw request.
+        """
+
+        return message.startswith(b"OPTIONS ")
+
+    @staticmethod
+    def get_origin(message: bytes) -> str | None:
+        """
+        Extract the Origin header of a raw request without parsing the whole request.
+
+        :param message: The raw request.
+
+        :return: The origin, or None if absent.
+        """
+
+        _raw_header = message.split(b"\r\n\r\n", 1)[0]
+        for line in _raw_header.split(b"\r\n")[1:]:
+            key, _, value = line.partition(b":")
+            if key.strip().lower() == b"origin":
+                return value.strip().decode(errors="replace")
+        return None
+
+    def allow_origin(self, origin: str | None) -> str | None:
+        """
+        Get the value of "Access-Control-Allow-Origin" for a request origin.
+
+        :param origin: The Origin header of the request.
+
+        :return: The header value, or None if the origin is not allowed.
+        """
+
+        if "*" in self.allowed_origins:
+            return "*"
+        if origin in self.allowed_origins:
+            return origin
+        return None
+
+    def apply(self, res: "Response", origin: str | None) -> None:
+        """
+        Add the CORS headers of an actual (non-preflight) request to its response.
+
+        :param res: The response.
+        :param origin: The Origin header of the request.
+        """
+
+        allow_origin = self.allow_origin(origin)
+        if "*" not in self.allowed_origins:
+            res.add_vary("Origin")
+        if not allow_origin:
+            return
+        res.headers["Access-Control-Allow-Origin"] = allow_origin
+        if self.allow_credentials:
+            res.headers["Access-Control-Allow-Credentials"] = "true"
+
+    def preflight_response(self, message: bytes) -> bytes:
+        """
+        Get the pre-built answer to a raw preflight request.
+
+        :param message: The raw preflight request.
+
+        :return: The response as bytes.
+        """
+
+        allow_origin = self.allow_origin(self.get_origin(message))
+        if allow_origin not in self._preflight_responses:
+            res = Response(body="", status=Status_204_NO_CONTENT, content_type="text/plain")
+            self.apply(res, allow_origin)
+            if allow_origin:
+                res.headers["Access-Control-Allow-Methods"] = ", ".join(self.allowed_methods)
+                res.headers["Access-Control-Allow-Headers"] = ", ".join(self.allowed_headers)
+                res.headers["Access-Control-Max-Age"] = str(self.max_age)
+            self._preflight_responses[allow_origin] = res.to_bytes()
+        return self._preflight_responses[allow_origin]
+
+
+class TokenBucket:
+    rate: float
+    burst: float
+    tokens: float
+    updated_at: float
+
+    def __init__(self, rate: float, burst: float) -> None:
+        """
+        Create a full token bucket.
+
+        :param rate: The number of tokens added per second.
+        :param burst: The capacity of the bucket.
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Take a token from the bucket.
+
+        :return: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """
+    One token bucket per key (client IP, user id, ...). The least recently seen keys
+    are forgotten beyond `max_keys`, a forgotten key starts again with a full bucket.
+    """
+
+    rate: float
+    burst: float
+    max_keys: int
+    buckets: collections.OrderedDict
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 10000) -> None:
+        """
+        :param rate: The sustained number of requests per second per key.
+        :param burst: The number of requests a key can make at once.
+        :param max_keys: The maximum number of keys tracked.
+        """
+
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = collections.OrderedDict()
+
+    def take(self, key: typing.Hashable) -> float:
+        """
+        Take a token from the bucket of the key.
+
+        :param key: The key to rate limit.
+
+        :return: 0 if the request is allowed, otherwise the seconds until it would be.
+        """
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket.take()
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+@dataclasses.dataclass
+class StaticFileInfo:
+    path: str
+    size: int
+    etag: str
+    content_type: str
+    gzip_path: str | None = None
+    gzip_size: int = 0
+
+
+class StaticFiles:
+    """
+    Handler serving the files of a directory (e.g. the Next.js static export in client/out).
+
+    File metadata is scanned once into a table, so a request is a dict lookup and only
+    files present at scan time can be served. Bodies are sent with `os.sendfile`.
+    Supports If-None-Match, single byte Range requests and precompressed `.gz` siblings.
+    """
+
+    root: str
+    prefix: str
+    immutable_prefixes: tuple[str, ...]
+    max_age: int
+    table: dict[str, StaticFileInfo]
+
+    def __init__(
+        self,
+        root: str,
+        prefix: str = "/",
+        immutable_prefixes: tuple[str, ...] = ("/_next/static/",),
+        max_age: int = 31536000,
+        logger: logging.Logger = logging.getLogger(__name__),
+    ) -> None:
+        """
+        :param root: The directory to serve.
+        :param prefix: The URL path the directory is mounted at.
+        :param immutable_prefixes: URL paths of content-hashed files, cached for `max_age`.
+        :param max_age: The "Cache-Control" max-age of immutable files, in seconds.
+        :param logger: The logger to use.
+        """
+
+        self.root = root
+        self.prefix = prefix.rstrip("/") + "/"
+        self.immutable_prefixes = immutable_prefixes
+        self.max_age = max_age
+        self.logger = logger
+        self.table = dict()
+        self.scan()
+
+    def scan(self) -> None:
+        """
+        (Re)build the metadata table from the files under `root`.
+        """
+
+        table = dict()
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".gz"):
+                    continue
+
+                path = os.path.join(dirpath, filename)
+                stat = os.stat(path)
+                content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+                info = StaticFileInfo(
+                    path=path,
+                    size=stat.st_size,
+                    etag=f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+                    content_type=content_type,
+                )
+                if os.path.isfile(path + ".gz"):
+                    info.gzip_path = path + ".gz"
+                    info.gzip_size = os.stat(info.gzip_path).st_size
+
+                url = "/" + os.path.relpath(path, self.root).replace(os.sep, "/")
+                table[url] = info
+                # pretty URLs of the static export: /dashboard -> /dashboard.html, / -> /index.html
+                if url.endswith("/index.html"):
+                    table.setdefault(url.removesuffix("index.html") or "/", info)
+                    table.setdefault(url.removesuffix("/index.html") or "/", info)
+                elif url.endswith(".html"):
+                    table.setdefault(url.removesuffix(".html"), info)
+
+        self.table = table
+        self.logger.info(f"StaticFiles - {len(table)} paths under {self.root}")
+
+    def lookup(self, path: str) -> StaticFileInfo | None:
+        """
+        Find the file served for a request path.
+
+        :param path: The request path, including the mount prefix.
+
+        :return: The file metadata, or None if nothing is served there.
+        """
+
+        if not path.startswith(self.prefix) and path != self.prefix.rstrip("/"):
+            return None
+        return self.table.get("/" + path[len(self.prefix):])
+
+    def __call__(self, ctx: Ctx, req: Request) -> Response:
+        info = self.lookup(req.path)
+        if not info:
+            return Router.not_found(ctx, req)
+
+        res = Response(body="", status=Status_200_OK, content_type=info.content_type)
+        if req.path.startswith(self.immutable_prefixes):
+            res.set_cache_control(f"public, max-age={self.max_age}, immutable")
+        else:
+            res.set_cache_control("public, no-cache")
+        res.set_header("Accept-Ranges", "bytes")
+
+        _range = req.headers.get("Range")
+        gzip = (
+            info.gzip_path
+            and not _range
+            and "gzip" in req.headers.get("Accept-Encoding", "")
+        )
+        if info.gzip_path:
+            res.add_vary("Accept-Encoding")
+        etag = info.etag[:-1] + '-gz"' if gzip else info.etag
+        res.set_etag(etag)
+
+        if req.matches_etag(etag):
+            not_modified = Response.not_modified(etag)
+            not_modified.set_cache_control(res.headers["Cache-Control"])
+            if "Vary" in res.headers:
+                not_modified.set_header("Vary", res.headers["Vary"])
+            return not_modified
+
+        if gzip:
+            res.set_header("Content-Encoding", "gzip")
+            res.file = FileBody(info.gzip_path, 0, info.gzip_size)
+            return res
+
+        res.file = FileBody(info.path, 0, info.size)
+        try:
+            byte_range = self.parse_range(_range, info.size) if _range else None
+        except RangeNotSatisfiable:
+            res.status = Status_416_RANGE_NOT_SATISFIABLE
+            res.file = None
+            res.set_header("Content-Range", f"bytes */{info.size}")
+            return res
+
+        if byte_range:
+            start, end = byte_range
+            res.status = Status_206_PARTIAL_CONTENT
+            res.file = FileBody(info.path, start, end - start + 1)
+            res.set_header("Content-Range", f"bytes {start}-{end}/{info.size}")
+        return res
+
+    @staticmethod
+    def parse_range(header: str, size: int) -> tuple[int, int] | None:
+        """
+        Parse a single-range "Range" header, e.g. "bytes=0-99", "bytes=100-" or "bytes=-100".
+        Raises RangeNotSatisfiable if the range lies outside of the file.
+
+        :param header: The value of the header.
+        :param size: The size of the file.
+
+        :return: The first and last byte positions (inclusive), or None if the header is
+                 malformed or uses an unsupported form (other units, multiple ranges) and
+                 must be ignored.
+        """
+
+        # an empty file is sent whole, there is no byte range to point at
+        unit, _, spec = header.partition("=")
+        if unit.strip() != "bytes" or "," in spec or size == 0:
+            return None
+
+        first, _, last = spec.strip().partition("-")
+        try:
+            if not first:
+                length = int(last)
+                if length <= 0:
+                    raise RangeNotSatisfiable()
+                return max(0, size - length), size - 1
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        except ValueError:
+            return None
+
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            raise RangeNotSatisfiable()
+        return start, end
+
+
 class Router:
     middlewares: list[Handler]
     routes: dict[str, Handler]
     global_middlewares: list[Middleware]
     route_middlewares: dict[str, list[Middleware]]
+    low_priority_routes: set[str]
+    mounts: list[tuple[str, Handler]]
 
     def __init__(self):
         self.middlewares = list()
         self.routes = dict()
         self.global_middlewares = list()
         self.route_middlewares = dict()
+        self.low_priority_routes = set()
+        self.mounts = list()
 
     @staticmethod
     def not_found(ctx: Ctx, req: Request) -> Response:
@@ -266,21 +998,80 @@ class Router:
         else:
             self.middlewares.append(middleware)
 
-    def register_route(self, method: str, path: str, handler: Handler) -> None:
+    def register_route(
+        self, method: str, path: str, handler: Handler, low_priority: bool = False
+    ) -> None:
         """
         Register a new route. All middlewares registered before this will be applied to this route.
 
         :param method: The HTTP method of the route.
         :param path: The path of the route.
         :param handler: The handler of the route.
+        :param low_priority: Whether the route is expensive and should be shed first under load.
         """
 
         self.routes[f"{method}:{path}"] = handler
+        if low_priority:
+            self.low_priority_routes.add(f"{method}:{path}")
 
         self.route_middlewares[f"{method}:{path}"] = list()
         for middleware in self.middlewares:
             self.route_middlewares[f"{method}:{path}"].append(middleware)
 
+    def mount(self, prefix: str, handler: Handler) -> None:
+        """
+        Register a handler for every GET request under a path prefix, e.g. a StaticFiles.
+        Routes registered with `register_route` take precedence, only global middlewares apply.
+
+        :param prefix: The path prefix.
+        :param handler: The handler.
+        """
+
+        self.mounts.append((prefix, handler))
+        self.mounts.sort(key=lambda mount: len(mount[0]), reverse=True)
+
+    def get_handler(self, req: Request) -> Handler:
+        """
+        Find the handler of a request: its route, else the longest matching mount.
+
+        :param req: The request.
+
+        :return: The handler, `not_found` if none matches.
+        """
+
+        handler = self.routes.get(req.get_route())
+        if handler:
+            return handler
+
+        if req.method == "GET":
+            for prefix, handler in self.mounts:
+                if req.path.startswith(prefix):
+                    return handler
+        return self.not_found
+
+    @staticmethod
+    def conditional(req: Request, res: Response) -> Response:
+        """
+        Replace a 200 response carrying an ETag with a 304 if the client already has it.
+        Handlers with a cheap ETag can also check `req.matches_etag` themselves, before
+        building the body.
+
+        :param req: The request.
+        :param res: The response from the handler.
+
+        :return: The response to send.
+        """
+
+        etag = res.headers.get("ETag")
+        if res.status == Status_200_OK and etag and req.method in ("GET", "HEAD") and req.matches_etag(etag):
+            not_modified = Response.not_modified(etag)
+            if "Cache-Control" in res.headers:
+                not_modified.set_cache_control(res.headers["Cache-Control"])
+            if "Vary" in res.headers:
+                not_modified.set_header("Vary", res.headers["Vary"])
+            return not_modified
+        return res
+
     def route(self, req: Request) -> Response:
         """
         Applies the middlewares to the request and routes it to the correct handler.
@@ -301,7 +1092,145 @@ class Router:
             res = middleware(ctx, req)
             if res:
                 return res
-        return self.routes.get(req.get_route(), self.not_found)(ctx, req)
+
+        res = self.get_handler(req)(ctx, req)
+        return self.conditional(req, res)
+
+    async def route_async(self, req: Request) -> Response:
+        """
+        Same as `route`, but awaits middlewares and handlers that are coroutine functions.
+
+        :param req: The request to route.
+
+        :return: The response from the handler.
+        """
+
+        ctx = dict()
+
+        middlewares = self.global_middlewares + self.route_middlewares.get(req.get_route(), list())
+        for middleware in middlewares:
+            res = middleware(ctx, req)
+            if inspect.isawaitable(res):
+                res = await res
+            if res:
+                return res
+
+        res = self.get_handler(req)(ctx, req)
+        if inspect.isawaitable(res):
+            res = await res
+        return self.conditional(req, res)
+
+
+class AdmissionControl:
+    """
+    Decides whether the server takes on a request, so it degrades gracefully under load:
+      - each client IP is rate limited with a token bucket (429)
+      - the number of requests being handled at once is bounded (503)
+      - low priority routes get a smaller share of that bound, so they are shed first
+    Rejections carry a "Retry-After" header.
+    """
+
+    max_in_flight: int
+    max_low_priority_in_flight: int
+    retry_after: float
+    ip_limiter: RateLimiter | None
+
+    in_flight: int
+    low_priority_in_flight: int
+    rate_limited: int
+    shed: int
+
+    def __init__(
+        self,
+        max_in_flight: int = 256,
+        max_low_priority_in_flight: int = 32,
+        retry_after: float = 1,
+        ip_limiter: RateLimiter | None = None,
+    ) -> None:
+        """
+        :param max_in_flight: The maximum number of requests handled at once.
+        :param max_low_priority_in_flight: The maximum number of low priority requests handled at once.
+        :param retry_after: The "Retry-After" of shed requests, in seconds.
+        :param ip_limiter: The per client IP rate limiter, None to disable.
+        """
+
+        self.max_in_flight = max_in_flight
+        self.max_low_priority_in_flight = max_low_priority_in_flight
+        self.retry_after = retry_after
+        self.ip_limiter = ip_limiter
+
+        self.in_flight = 0
+        self.low_priority_in_flight = 0
+        self.rate_limited = 0
+        self.shed = 0
+
+    def admit(self, req: Request, low_priority: bool) -> Response | None:
+        """
+        Try to admit a request. An admitted request must be `release`d once handled.
+
+        :param req: The request.
+        :param low_priority: Whether the request targets a low priority route.
+
+        :return: None if admitted, otherwise the rejection response.
+        """
+
+        if self.ip_limiter and req.client_address:
+            wait = self.ip_limiter.take(req.client_address[0])
+            if wait:
+                self.rate_limited += 1
+                return Response.retry_later(wait, status=Status_429_TOO_MANY_REQUESTS)
+
+        if self.in_flight >= self.max_in_flight or (
+            low_priority and self.low_priority_in_flight >= self.max_low_priority_in_flight
+        ):
+            self.shed += 1
+            return Response.retry_later(self.retry_after)
+
+        self.in_flight += 1
+        if low_priority:
+            self.low_priority_in_flight += 1
+        return None
+
+    def release(self, low_priority: bool) -> None:
+        """
+        Mark an admitted request as handled.
+
+        :param low_priority: Whether the request targets a low priority route.
+        """
+
+        self.in_flight -= 1
+        if low_priority:
+            self.low_priority_in_flight -= 1
+
+
+def create_tls_context(
+    certfile: str,
+    keyfile: str | None = None,
+    alpn_protocols: list[str] | None = None,
+    num_tickets: int = 2,
+) -> ssl.SSLContext:
+    """
+    Create the server side TLS context shared by every connection.
+
+    Sessions are resumed without a full handshake, either from a TLS 1.3 ticket or from
+    the session cache of the context (TLS 1.2). Ticket keys live in the context, so
+    resumption works for as long as the process runs.
+
+    :param certfile: The path of the PEM certificate chain.
+    :param keyfile: The path of the PEM private key, None if it is in `certfile`.
+    :param alpn_protocols: The protocols offered with ALPN, defaults to HTTP/1.1.
+    :param num_tickets: The number of session tickets issued per full TLS 1.3 handshake.
+
+    :return: The TLS context.
+    """
+
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.minimum_version = ssl.TLSVersion.TLSv1_2
+    context.load_cert_chain(certfile, keyfile)
+    context.set_alpn_protocols(alpn_protocols or ["http/1.1"])
+    context.options &= ~ssl.OP_NO_TICKET
+    context.num_tickets = num_tickets
+    return context
 
 
 class Server:
@@ -311,20 +1240,33 @@ class Server:
     server_port: int
 
     router = Router()
+    cors: Cors
+    admission: AdmissionControl | None
+    max_body_size: int
 
     def __init__(
         self,
         server_port: int = 6969,
         logger: logging.Logger = logging.getLogger(__name__),
+        cors: Cors | None = None,
+        admission: AdmissionControl | None = None,
+        max_body_size: int = 1024 * 1024,
     ) -> None:
         """
         Create a new server instance.
 
         :param server_port: The port the server should run on.
         :param logger: The logger to use.
+        :param cors: The CORS policy, defaults to allowing every origin.
+        :param admission: The admission control, None admits every request.
+        :param max_body_size: The maximum size of a buffered request body, multipart bodies
+            are streamed to the handler instead (AsyncServer only).
         """
 
         self.logger = logger
+        self.cors = cors or Cors()
+        self.admission = admission
+        self.max_body_size = max_body_size
 
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_port = server_port
@@ -340,6 +1282,33 @@ class Server:
         self.router.register_route("PATCH", "/debug", Router.debug)
         self.router.register_route("DELETE", "/debug", Router.debug)
 
+    def admit(self, req: Request) -> Response | None:
+        """
+        Run the admission control on a request.
+
+        :param req: The request.
+
+        :return: None if admitted, otherwise the rejection response.
+        """
+
+        if not self.admission:
+            return None
+
+        res = self.admission.admit(req, req.get_route() in self.router.low_priority_routes)
+        if res:
+            self.logger.warning(f"{req.client_address}: Rejected with status {res.status}")
+        return res
+
+    def release(self, req: Request) -> None:
+        """
+        Release an admitted request once it has been handled.
+
+        :param req: The request.
+        """
+
+        if self.admission:
+            self.admission.release(req.get_route() in self.router.low_priority_routes)
+
     def bind(self) -> None:
         """
         Bind the server to the port and start listening for connections.
@@ -355,6 +1324,7 @@ class Server:
         """
 
         while True:
+            origin = None
             try:
                 connection_socket, client_address = self.server_socket.accept()
                 connection_socket.settimeout(2)
@@ -362,10 +1332,30 @@ class Server:
 
                 message = connection_socket.recv(9192)
 
+                if self.cors.is_preflight(message):
+                    # preflight requests carry no body, nothing is left to drain
+                    connection_socket.sendall(self.cors.preflight_response(message))
+                    connection_socket.close()
+                    continue
+
                 request = Request.from_bytes(message)
+                request.client_address = client_address
+                origin = request.headers.get("Origin")
                 self.logger.debug(f"{client_address}: Received request: {request}")
 
-                response = self.router.route(request)
+                response = self.admit(request)
+                if not response:
+                    try:
+                        response = self.router.route(request)
+                    finally:
+                        self.release(request)
+
+                if response.stream:
+                    # streams are async iterators fed by the event loop, see AsyncServer
+                    self.logger.error(f"{client_address}: Streaming response on a blocking Server")
+                    response = Response.from_text(
+                        "Internal Server Error", status=Status_500_INTERNAL_SERVER_ERROR
+                    )
             except TimeoutError:
                 response = Response.from_text("Timeout", status=Status_504_GATEWAY_TIMEOUT)
             except Exception as e:
@@ -381,6 +1371,7 @@ class Server:
                 self.logger.info(f"{client_address}: Response: {response.body}")
 
                 self.logger.info(f"{client_address}: Sending response")
+                self.cors.apply(response, origin)
                 response.send(connection_socket)
                 self.logger.info(f"{client_address}: Response sent")
 
@@ -393,3 +1384,274 @@ class Server:
                 connection_socket.close()
             except Exception:
                 pass
+
+
+class AsyncServer(Server):
+    """
+    Event-loop variant of Server. Each connection is served by a coroutine, so handlers
+    awaiting I/O (e.g. the database) do not block other clients.
+    It can also terminate TLS, the handshakes do not block other clients either.
+    """
+
+    ssl_context: ssl.SSLContext | None
+    tls_handshake_timeout: float
+
+    def __init__(
+        self,
+        *args: typing.Any,
+        ssl_context: ssl.SSLContext | None = None,
+        tls_handshake_timeout: float = 5,
+        **kwargs: typing.Any,
+    ) -> None:
+        """
+        Create a new server instance, see `Server.__init__` for the other parameters.
+
+        :param ssl_context: The TLS context (see `create_tls_context`), None for plain TCP.
+        :param tls_handshake_timeout: The time in seconds a client has to complete the TLS handshake.
+        """
+
+        super().__init__(*args, **kwargs)
+        self.ssl_context = ssl_context
+        self.tls_handshake_timeout = tls_handshake_timeout
+
+    def run(self) -> None:
+        """
+        The main loop of the server. This will block the execution of the program.
+        """
+
+        asyncio.run(self.serve())
+
+    async def serve(self) -> None:
+        """
+        Accept connections on the bound socket until cancelled.
+        """
+
+        # the TLS handshake of each connection runs in its own task, before handle_connection
+        server = await asyncio.start_server(
+            self.handle_connection,
+            sock=self.server_socket,
+            ssl=self.ssl_context,
+            ssl_handshake_timeout=self.tls_handshake_timeout if self.ssl_context else None,
+        )
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Serve a single request on a connection, mirroring `Server.run`.
+
+        :param reader: The stream to read the request from.
+        :param writer: The stream to write the response to.
+        """
+
+        client_address = writer.get_extra_info("peername")
+        self.logger.info(f"{client_address}: Connection established")
+
+        origin = None
+        try:
+            message = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=2)
+
+            if self.cors.is_preflight(message):
+                # preflight requests carry no body, nothing is left to drain
+                writer.write(self.cors.preflight_response(message))
+                await writer.drain()
+                writer.close()
+                return
+
+            request = Request.from_bytes(message)
+            request.client_address = client_address
+            origin = request.headers.get("Origin")
+
+            response = await self.read_body(request, reader)
+            self.logger.debug(f"{client_address}: Received request: {request}")
+
+            if not response:
+                response = self.admit(request)
+            if not response:
+                try:
+                    response = await self.router.route_async(request)
+                finally:
+                    self.release(request)
+        except TimeoutError:
+            response = Response.from_text("Timeout", status=Status_504_GATEWAY_TIMEOUT)
+        except Exception as e:
+            self.logger.exception(f"{client_address}: {e}")
+            response = Response.from_text(
+                "Internal Server Error", status=Status_500_INTERNAL_SERVER_ERROR
+            )
+
+        try:
+            self.logger.info(
+                f"{client_address}: Responding with status {response.status}"
+            )
+            self.logger.info(f"{client_address}: Response: {response.body}")
+
+            self.logger.info(f"{client_address}: Sending response")
+            self.cors.apply(response, origin)
+            if response.stream:
+                await self.send_stream(response, reader, writer)
+                self.logger.info(f"{client_address}: Stream closed")
+                return
+            await response.send_async(writer)
+            self.logger.info(f"{client_address}: Response sent")
+
+            # TLS transports cannot half-close, closing them sends close_notify instead
+            if writer.can_write_eof():
+                writer.write_eof()
+
+                # Drain the socket, see: https://blog.netherlabs.nl/articles/2009/01/18/the-ultimate-so_linger-page-or-why-is-my-tcp-not-reliable
+                while await asyncio.wait_for(reader.read(4096), timeout=2):
+                    pass
+        except Exception:
+            pass
+        finally:
+            writer.close()
+
+    async def read_body(
+        self, request: Request, reader: asyncio.StreamReader
+    ) -> Response | None:
+        """
+        Read the body announced by "Content-Length" into `request.body`, or attach a
+        `MultipartReader` for multipart/form-data so the handler can stream it.
+
+        :param request: The request, parsed from its head.
+        :param reader: The connection, positioned at the start of the body.
+
+        :return: None on success, otherwise the error response.
+        """
+
+        content_length = int(request.headers.get("Content-Length", 0))
+        if not content_length:
+            return None
+
+        boundary = MultipartReader.boundary(request.headers.get("Content-Type", ""))
+        if boundary:
+            request.multipart = MultipartReader(reader, boundary, content_length)
+            return None
+
+        if content_length > self.max_body_size:
+            return Response.from_text(
+                "Payload Too Large", status=Status_413_PAYLOAD_TOO_LARGE
+            )
+
+        body = await asyncio.wait_for(reader.readexactly(content_length), timeout=2)
+        request.body = Request.parse_body(request.headers, body.decode())
+        return None
+
+    async def send_stream(
+        self, response: Response, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """
+        Send a streaming response until its stream is exhausted or the client disconnects.
+        The stream is closed either way, so it can clean up after itself.
+
+        :param response: The response, with `stream` set.
+        :param reader: The stream of the client, watched for disconnection.
+        :param writer: The stream to write the response to.
+        """
+
+        async def pump() -> None:
+            writer.write(response.to_bytes())
+            await writer.drain()
+            async for chunk in response.stream:
+                writer.write(chunk)
+                await writer.drain()
+
+        async def disconnected() -> None:
+            try:
+                while await reader.read(4096):
+                    pass
+            except ConnectionError:
+                pass
+
+        tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(disconnected())]
+        try:
+            await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await response.stream.aclose()
+
+
+class EventBroker:
+    """
+    Fans out Server-Sent Events to subscribers, grouped by key (e.g. per user).
+
+    Each subscriber gets a bounded queue, the oldest events are dropped if it falls behind.
+    Idle streams get a heartbeat comment so proxies keep them open and dead clients are noticed.
+    Must be used from the event loop of the AsyncServer.
+    """
+
+    max_subscribers: int
+    heartbeat_interval: float
+    queue_size: int
+    subscribers: dict[typing.Hashable, set[asyncio.Queue]]
+
+    def __init__(
+        self, max_subscribers: int = 1000, heartbeat_interval: float = 15, queue_size: int = 64
+    ) -> None:
+        """
+        :param max_subscribers: The maximum number of open streams, further ones get a 503.
+        :param heartbeat_interval: The seconds of inactivity before a heartbeat is sent.
+        :param queue_size: The number of undelivered events kept per subscriber.
+        """
+
+        self.max_subscribers = max_subscribers
+        self.heartbeat_interval = heartbeat_interval
+        self.queue_size = queue_size
+        self.subscribers = dict()
+
+    def subscriber_count(self) -> int:
+        return sum(len(queues) for queues in self.subscribers.values())
+
+    def publish(self, key: typing.Hashable, event: str, data: typing.Any) -> None:
+        """
+        Send an event to every subscriber of a key.
+
+        :param key: The key of the subscribers.
+        :param event: The event type.
+        :param data: The JSON serializable payload.
+        """
+
+        message = f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+        for queue in self.subscribers.get(key, ()):
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def subscribe(self, key: typing.Hashable) -> Response:
+        """
+        Create the streaming response of a new subscriber.
+
+        :param key: The key to subscribe to.
+
+        :return: The text/event-stream response, or a 503 if there are too many subscribers.
+        """
+
+        if self.subscriber_count() >= self.max_subscribers:
+            return Response.retry_later(self.heartbeat_interval)
+
+        res = Response(body="", status=Status_200_OK, content_type="text/event-stream")
+        res.set_cache_control("no-cache")
+        res.stream = self._stream(key)
+        return res
+
+    async def _stream(self, key: typing.Hashable) -> typing.AsyncIterator[bytes]:
+        # registered on first iteration, so a response that is never sent leaks nothing
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.subscribers.setdefault(key, set()).add(queue)
+        try:
+            yield f"retry: {int(self.heartbeat_interval * 1000)}\n\n".encode()
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=self.heartbeat_interval)
+                except TimeoutError:
+                    message = b": heartbeat\n\n"
+                yield message
+        finally:
+            self.subscribers[key].discard(queue)
+            if not self.subscribers[key]:
+                del self.subscribers[key]
@@ -1,11 +1,27 @@
 from app import repository, models, utils
 import json
+import asyncio
 from app import framework, mailer
+from app.config import settings
 from app.framework import Response, Request, Ctx
-from pydantic import ValidationError
+from pydantic import Field, TypeAdapter, ValidationError
+from typing import Annotated
 
 
-repo = repository.MongoRepository()
+repo = repository.create_async_repository()
+
+# delivery status of the mails of each user, streamed by GET /events
+events = framework.EventBroker(
+    max_subscribers=settings.EVENTS_MAX_SUBSCRIBERS,
+    heartbeat_interval=settings.EVENTS_HEARTBEAT_INTERVAL,
+)
+
+send_mails_adapter = TypeAdapter(
+    Annotated[
+        list[models.SendMail],
+        Field(min_length=1, max_length=settings.MAIL_BATCH_MAX_SIZE),
+    ]
+)
 
 
 def get_me(ctx: Ctx, req: Request) -> Response:
@@ -23,10 +39,13 @@ def get_me(ctx: Ctx, req: Request) -> Response:
     """
 
     user: models.User = ctx.get("user")
-    return Response.from_json(user.model_dump(exclude={"hashed_password"}))
+    res = Response.from_json(user.model_dump(exclude={"hashed_password"}))
+    res.set_etag()
+    res.set_cache_control("private, no-cache")
+    return res
 
 
-def get_users(ctx: Ctx, req: Request) -> Response:
+async def get_users(ctx: Ctx, req: Request) -> Response:
     """
     Get all users.
 
@@ -42,11 +61,11 @@ def get_users(ctx: Ctx, req: Request) -> Response:
     ```
     """
 
-    users = [user.model_dump(exclude={"hashed_password"}) for user in repo.get_users()]
+    users = [user.model_dump(exclude={"hashed_password"}) for user in await repo.get_users()]
     return Response.from_json(users)
 
 
-def create_user(ctx: Ctx, req: Request) -> Response:
+async def create_user(ctx: Ctx, req: Request) -> Response:
     """
     Create a new user.
 
@@ -81,7 +100,7 @@ def create_user(ctx: Ctx, req: Request) -> Response:
         return Response.validation_error(e.json())
 
     duplicate_field = ""
-    if repo.get_user({"username": user.username}):
+    if await repo.get_user({"username": user.username}):
         duplicate_field = "username"
 
     if duplicate_field:
@@ -91,7 +110,7 @@ def create_user(ctx: Ctx, req: Request) -> Response:
         }
         return Response.from_json(body, status=framework.Status_409_CONFLICT)
 
-    user = repo.create_user(
+    user = await repo.create_user(
         models.User(
             username=user.username,
             email=user.email,
@@ -101,7 +120,7 @@ def create_user(ctx: Ctx, req: Request) -> Response:
     return Response.from_json(user.model_dump(exclude={"hashed_password"}))
 
 
-def login_user(ctx: Ctx, req: Request) -> Response:
+async def login_user(ctx: Ctx, req: Request) -> Response:
     """
     Login a user. Set a cookie with RAW USER DATA.
 
@@ -124,7 +143,7 @@ def login_user(ctx: Ctx, req: Request) -> Response:
     except ValidationError as e:
         return Response.validation_error(e.json())
 
-    user = repo.get_user({"username": credentials.username})
+    user = await repo.get_user({"username": credentials.username})
     if not user:
         return Response.from_text(
             "User not found", status=framework.Status_404_NOT_FOUND
@@ -143,7 +162,7 @@ def login_user(ctx: Ctx, req: Request) -> Response:
     return res
 
 
-def send_mail(ctx: Ctx, req: Request) -> Response:
+async def send_mail(ctx: Ctx, req: Request) -> Response:
     """
     Send an email.
 
@@ -156,16 +175,29 @@ def send_mail(ctx: Ctx, req: Request) -> Response:
     }
     ```
 
+    Or, to send attachments, a multipart/form-data body with the fields `to`, `subject`
+    and `body`, and any number of file parts. Files are streamed to GridFS as they arrive.
+
     Responses:
     - 200: Email sent successfully.
     - 400: Invalid request body.
+    - 413: Attachments too large.
     - 500: Email not sent.
     """
 
     user: models.User = ctx.get("user")
 
+    if req.multipart:
+        return await send_mail_with_attachments(user, req.multipart)
+
+    event = None
     try:
-        mailer.send(user.email, req.body["to"], req.body["subject"], req.body["body"])
+        event = {"to": req.body["to"], "subject": req.body["subject"]}
+        events.publish(user.id, "queued", event)
+
+        await asyncio.to_thread(
+            mailer.send, user.email, req.body["to"], req.body["subject"], req.body["body"]
+        )
 
         mail = models.Mail(
             user_id=user.id,
@@ -173,17 +205,234 @@ def send_mail(ctx: Ctx, req: Request) -> Response:
             subject=req.body["subject"],
             body=req.body["body"],
         )
-        repo.create_mail(mail)
+        await repo.create_mail(mail)
+        events.publish(user.id, "sent", {**event, "id": mail.id})
 
         return Response.from_text("Email sent")
     except Exception as e:
+        if event:
+            events.publish(user.id, "failed", {**event, "error": "Email not sent"})
         return Response.from_text(
             "Email not sent", status=framework.Status_500_INTERNAL_SERVER_ERROR
         )
 
-def get_mails(ctx: Ctx, req: Request) -> Response:
+
+# form fields of a multipart mail are buffered, they are small
+MAIL_FIELD_MAX_SIZE = 1024 * 1024
+
+
+class AttachmentsTooLarge(Exception):
+    pass
+
+
+async def send_mail_with_attachments(
+    user: models.User, multipart: framework.MultipartReader
+) -> Response:
+    """
+    Send an email from a multipart/form-data body, see `send_mail`.
+    """
+
+    fields = dict()
+    attachments: list[models.Attachment] = list()
+    event = None
+
+    try:
+        total_size = 0
+        async for part in multipart:
+            if part.filename is None:
+                fields[part.name] = (await part.read(MAIL_FIELD_MAX_SIZE)).decode()
+                continue
+
+            upload = repo.open_attachment_upload(part.filename, part.content_type)
+            size = 0
+            try:
+                while chunk := await part.read_chunk():
+                    size += len(chunk)
+                    total_size += len(chunk)
+                    if total_size > settings.MAIL_MAX_ATTACHMENTS_SIZE:
+                        raise AttachmentsTooLarge()
+                    await upload.write(chunk)
+                await upload.close()
+            except BaseException:
+                # removes the chunks already flushed, finished files are removed below
+                await upload.abort()
+                raise
+
+            attachments.append(
+                models.Attachment(
+                    file_id=str(upload._id),
+                    filename=part.filename,
+                    content_type=part.content_type,
+                    size=size,
+                )
+            )
+
+        message = models.SendMail.model_validate(fields)
+
+        event = {"to": message.to, "subject": message.subject}
+        events.publish(user.id, "queued", event)
+
+        # the mailer runs in a worker thread, it pulls the attachments from GridFS through the loop
+        loop = asyncio.get_running_loop()
+
+        def read_attachment(file_id: str):
+            grid_out = asyncio.run_coroutine_threadsafe(repo.open_attachment(file_id), loop).result()
+            while chunk := asyncio.run_coroutine_threadsafe(grid_out.readchunk(), loop).result():
+                yield chunk
+
+        await asyncio.to_thread(
+            mailer.send_mime,
+            user.email,
+            message.to,
+            message.subject,
+            message.body,
+            [
+                (attachment.filename, attachment.content_type, read_attachment(attachment.file_id))
+                for attachment in attachments
+            ],
+        )
+
+        mail = models.Mail(
+            user_id=user.id,
+            to=message.to,
+            subject=message.subject,
+            body=message.body,
+            attachments=attachments,
+        )
+        await repo.create_mail(mail)
+        events.publish(user.id, "sent", {**event, "id": mail.id})
+
+        return Response.from_text("Email sent")
+    except ValidationError as e:
+        await delete_attachments(attachments)
+        return Response.validation_error(e.json())
+    except AttachmentsTooLarge:
+        await delete_attachments(attachments)
+        return Response.from_text(
+            "Attachments too large", status=framework.Status_413_PAYLOAD_TOO_LARGE
+        )
+    except ValueError:
+        await delete_attachments(attachments)
+        return Response.from_text(
+            "Invalid multipart body", status=framework.Status_400_BAD_REQUEST
+        )
+    except Exception as e:
+        await delete_attachments(attachments)
+        if event:
+            events.publish(user.id, "failed", {**event, "error": "Email not sent"})
+        return Response.from_text(
+            "Email not sent", status=framework.Status_500_INTERNAL_SERVER_ERROR
+        )
+
+
+async def delete_attachments(attachments: list[models.Attachment]) -> None:
+    for attachment in attachments:
+        try:
+            await repo.delete_attachment(attachment.file_id)
+        except Exception:
+            pass
+
+
+async def send_mails(ctx: Ctx, req: Request) -> Response:
+    """
+    Send several emails at once, over a single SMTP session and a single insert.
+
+    Request body:
+    ```json
+    [
+        {
+            "to": "string",
+            "subject": "string",
+            "body": "string"
+        }
+    ]
+    ```
+
+    Response body, one entry per email in request order:
+    ```json
+    [
+        {
+            "to": "string",
+            "sent": true,
+            "id": "string | null",
+            "error": "string | null"
+        }
+    ]
+    ```
+
+    Responses:
+    - 200: Batch processed, see `sent` for each email.
+    - 400: Invalid request body.
+    - 500: Emails not sent.
+    """
+
+    user: models.User = ctx.get("user")
+
+    try:
+        messages = send_mails_adapter.validate_python(req.body)
+    except ValidationError as e:
+        return Response.validation_error(e.json())
+
+    for message in messages:
+        events.publish(user.id, "queued", {"to": message.to, "subject": message.subject})
+
+    try:
+        errors = await asyncio.to_thread(
+            mailer.send_batch,
+            user.email,
+            [(message.to, message.subject, message.body) for message in messages],
+        )
+
+        sent = [
+            models.Mail(
+                user_id=user.id,
+                to=message.to,
+                subject=message.subject,
+                body=message.body,
+            )
+            for message, error in zip(messages, errors)
+            if error is None
+        ]
+        if sent:
+            await repo.create_mails(sent)
+    except Exception as e:
+        for message in messages:
+            events.publish(
+                user.id,
+                "failed",
+                {"to": message.to, "subject": message.subject, "error": "Emails not sent"},
+            )
+        return Response.from_text(
+            "Emails not sent", status=framework.Status_500_INTERNAL_SERVER_ERROR
+        )
+
+    sent_ids = iter(mail.id for mail in sent)
+    results = [
+        {
+            "to": message.to,
+            "sent": error is None,
+            "id": next(sent_ids) if error is None else None,
+            "error": error,
+        }
+        for message, error in zip(messages, errors)
+    ]
+    for result, message in zip(results, messages):
+        event = {"to": message.to, "subject": message.subject}
+        if result["sent"]:
+            events.publish(user.id, "sent", {**event, "id": result["id"]})
+        else:
+            events.publish(user.id, "failed", {**event, "error": result["error"]})
+    return Response.from_json(results)
+
+
+async def get_mails(ctx: Ctx, req: Request) -> Response:
     """
     Get all mails send by the current user.
+    Supports conditional requests: a matching If-None-Match gets a 304 without hitting the database.
+
+    Query parameters:
+    - body: "false" to leave out the (possibly compressed) bodies, which are then neither
+      read from the database nor decompressed.
 
     Response body:
     ```json
@@ -198,12 +447,183 @@ def get_mails(ctx: Ctx, req: Request) -> Response:
     ```
     """
 
+    user: models.User = ctx.get("user")
+    with_body = req.params.get("body") != "false"
+
+    etag = f'"{user.id}-{repo.mailbox_versions.get(user.id)}{"" if with_body else "-nobody"}"'
+    if req.matches_etag(etag):
+        res = Response.not_modified(etag)
+        res.set_cache_control("private, no-cache")
+        return res
+
+    try:
+        mails = [
+            mail.model_dump(exclude=None if with_body else {"body"})
+            for mail in await repo.get_mails_by_user_id(user.id, with_body=with_body)
+        ]
+        res = Response.from_json(mails)
+        res.set_etag(etag)
+        res.set_cache_control("private, no-cache")
+        return res
+    except Exception as e:
+        return Response.from_text(
+            "Unexpected Error", status=framework.Status_500_INTERNAL_SERVER_ERROR
+        )
+
+
+def mail_events(ctx: Ctx, req: Request) -> Response:
+    """
+    Stream the delivery status of the current user's mails as Server-Sent Events.
+    EventSource cannot set headers, so the token may be passed as the `token` query parameter.
+
+    Events:
+    - queued: `{"to": "string", "subject": "string"}`
+    - sent: `{"to": "string", "subject": "string", "id": "string"}`
+    - failed: `{"to": "string", "subject": "string", "error": "string"}`
+
+    Responses:
+    - 200: text/event-stream, kept open until the client disconnects.
+    - 503: Too many subscribers.
+    """
+
+    user: models.User = ctx.get("user")
+    return events.subscribe(user.id)
+
+
+async def get_mail_stats(ctx: Ctx, req: Request) -> Response:
+    """
+    Get the statistics of the mails sent by the current user. Counters are maintained when
+    mails are created, so this is a single document read however many mails were sent.
+    Supports conditional requests, like `get_mails`.
+
+    Response body:
+    ```json
+    {
+        "total": 0,
+        "per_day": {"YYYY-MM-DD": 0},
+        "per_recipient": {"string": 0}
+    }
+    ```
+    """
+
+    user: models.User = ctx.get("user")
+
+    etag = f'"stats-{user.id}-{repo.mailbox_versions.get(user.id)}"'
+    if req.matches_etag(etag):
+        res = Response.not_modified(etag)
+        res.set_cache_control("private, no-cache")
+        return res
+
+    try:
+        stats = await repo.get_mail_stats(user.id)
+        res = Response.from_json(stats.model_dump())
+        res.set_etag(etag)
+        res.set_cache_control("private, no-cache")
+        return res
+    except Exception as e:
+        return Response.from_text(
+            "Unexpected Error", status=framework.Status_500_INTERNAL_SERVER_ERROR
+        )
+
+
+async def search_mails(ctx: Ctx, req: Request) -> Response:
+    """
+    Search the mails sent by the current user, by subject, recipient and body.
+    Results are ranked by relevance (subject > recipient > body).
+    Bodies stored compressed (see MAIL_BODY_COMPRESSION_THRESHOLD) are not indexed.
+
+    Query parameters:
+    - q: The search terms, "quoted phrases" and -negations are supported.
+    - page: The page, starting at 1.
+    - per_page: The number of results per page.
+
+    Response body:
+    ```json
+    {
+        "results": [
+            {
+                "id": "string",
+                "to": "string",
+                "subject": "string",
+                "body": "string",
+                "score": 0.0
+            }
+        ],
+        "page": 1,
+        "per_page": 20,
+        "has_more": false
+    }
+    ```
+
+    Responses:
+    - 200: Search results.
+    - 400: Invalid query parameters.
+    """
+
     user: models.User = ctx.get("user")
 
     try:
-        mails = [mail.model_dump() for mail in repo.get_mails_by_user_id(user.id)]
-        return Response.from_json(mails)
+        search = models.SearchMails.model_validate(req.params)
+    except ValidationError as e:
+        return Response.validation_error(e.json())
+
+    try:
+        # fetch one extra result to know whether there is a next page
+        results = await repo.search_mails(
+            user.id,
+            search.q,
+            skip=(search.page - 1) * search.per_page,
+            limit=search.per_page + 1,
+        )
     except Exception as e:
         return Response.from_text(
             "Unexpected Error", status=framework.Status_500_INTERNAL_SERVER_ERROR
         )
+
+    body = {
+        "results": [
+            {**mail.model_dump(), "score": score}
+            for mail, score in results[: search.per_page]
+        ],
+        "page": search.page,
+        "per_page": search.per_page,
+        "has_more": len(results) > search.per_page,
+    }
+    return Response.from_json(body)
+
+
+def get_metrics(ctx: Ctx, req: Request) -> Response:
+    """
+    Get the runtime metrics of this process.
+
+    Response body:
+    ```json
+    {
+        "user_cache": {
+            "user": {"hits": 0, "misses": 0, "size": 0},
+            "users": {"hits": 0, "misses": 0, "size": 0}
+        },
+        "writes": {
+            "users": {
+                "flushes": 0,
+                "inserted": 0,
+                "failed": 0,
+                "pending": 0,
+                "largest_batch": 0,
+                "mean_batch": 0.0,
+                "mean_wait_ms": 0.0
+            },
+            "mails": {...}
+        }
+    }
+    ```
+    `user_cache` is null when USER_CACHE_ENABLED is off.
+    """
+
+    body = {
+        "user_cache": repo.cache_stats() if hasattr(repo, "cache_stats") else None,
+        "writes": repo.write_stats(),
+    }
+    res = Response.from_json(body)
+    res.set_cache_control("no-store")
+    return res
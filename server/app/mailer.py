@@ -1,58 +1,258 @@
+import uuid
 import socket
 import base64
+import typing
+import email.header
 
 from app import logger
 from app.config import settings
 
-def send(from_email: str, to_email: str, subject: str = "(no subject)", message_body: str = "(no body)"):
-    email_message = f"""\
+def _command(server: socket.socket, command: bytes) -> str:
+    server.send(command)
+    response = server.recv(1024).decode()
+    logger.mailer.info(response)
+    return response
+
+
+def _build_message(from_email: str, to_email: str, subject: str, message_body: str) -> str:
+    return f"""\
 From: {from_email}
 To: {to_email}
 Subject: {subject}
 
 {message_body}
 """
-    logger.mailer.info(f"Sending email from {from_email} to {to_email} with subject {subject}")
 
+
+def _open_session() -> socket.socket:
     server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    # a stalled server must not hold a worker thread (and its admission slot) forever
+    server.settimeout(settings.MAIL_TIMEOUT)
     server.connect((settings.MAIL_SERVER, settings.MAIL_PORT))
     response = server.recv(1024).decode()
     logger.mailer.info(response)
 
-    server.send(b'EHLO ALICE\r\n')
-    response = server.recv(1024).decode()
-    logger.mailer.info(response)
+    _command(server, b'EHLO ALICE\r\n')
+    _command(server, b'AUTH LOGIN\r\n')
+    _command(server, base64.b64encode(settings.MAIL_USERNAME.encode()) + b'\r\n')
+    _command(server, base64.b64encode(settings.MAIL_PASSWORD.encode()) + b'\r\n')
+    return server
 
-    server.send(b'AUTH LOGIN\r\n')
-    response = server.recv(1024).decode()
-    logger.mailer.info(response)
 
-    server.send(base64.b64encode(settings.MAIL_USERNAME.encode()) + b'\r\n')
-    response = server.recv(1024).decode()
-    logger.mailer.info(response)
+def _close_session(server: socket.socket) -> None:
+    try:
+        _command(server, b'QUIT\r\n')
+    except OSError:
+        pass
+    finally:
+        server.close()
 
-    server.send(base64.b64encode(settings.MAIL_PASSWORD.encode()) + b'\r\n')
-    response = server.recv(1024).decode()
-    logger.mailer.info(response)
 
-    server.send(f"MAIL FROM:<{from_email}>\r\n".encode())
-    response = server.recv(1024).decode()
-    logger.mailer.info(response)
+def _deliver(server: socket.socket, from_email: str, to_email: str, email_message: str) -> str | None:
+    """
+    Run one MAIL/RCPT/DATA transaction on an open session.
 
-    server.send(f"RCPT TO:<{to_email}>\r\n".encode())
-    response = server.recv(1024).decode()
-    logger.mailer.info(response)
+    :return: None if the mail was accepted, otherwise the reply of the failing step.
+    """
 
-    server.send(b'DATA\r\n')
-    response = server.recv(1024).decode()
-    logger.mailer.info(response)
+    steps = [
+        (f"MAIL FROM:<{from_email}>\r\n".encode(), ("250",)),
+        (f"RCPT TO:<{to_email}>\r\n".encode(), ("250", "251")),
+        (b'DATA\r\n', ("354",)),
+        (email_message.encode() + b'\r\n.\r\n', ("250",)),
+    ]
+    for command, expected in steps:
+        response = _command(server, command)
+        if not response.startswith(expected):
+            if command != steps[-1][0]:
+                _command(server, b'RSET\r\n')
+            return response.strip()
+    return None
+
+
+def send(from_email: str, to_email: str, subject: str = "(no subject)", message_body: str = "(no body)"):
+    """
+    Send a single mail in its own SMTP session.
+
+    Raises RuntimeError if the server rejects the mail.
+    """
+
+    email_message = _build_message(from_email, to_email, subject, message_body)
+    logger.mailer.info(f"Sending email from {from_email} to {to_email} with subject {subject}")
+
+    server = _open_session()
+    try:
+        error = _deliver(server, from_email, to_email, email_message)
+    finally:
+        _close_session(server)
+    if error is not None:
+        raise RuntimeError(error)
 
-    server.send(email_message.encode() + b'\r\n.\r\n')
-    response = server.recv(1024).decode()
-    logger.mailer.info(response)
 
-    server.send(b'QUIT\r\n')
+def send_batch(from_email: str, mails: list[tuple[str, str, str]]) -> list[str | None]:
+    """
+    Send several mails over a single SMTP session.
+
+    :param from_email: The sender of all the mails.
+    :param mails: (to_email, subject, message_body) of each mail.
+
+    :return: Per mail, None if it was accepted, otherwise the SMTP error reply. If the
+             connection is lost, the mail being sent and the remaining ones are failed.
+    """
+
+    logger.mailer.info(f"Sending {len(mails)} emails from {from_email}")
+
+    server = _open_session()
+    results: list[str | None] = []
+    for to_email, subject, message_body in mails:
+        try:
+            results.append(
+                _deliver(server, from_email, to_email, _build_message(from_email, to_email, subject, message_body))
+            )
+        except OSError as e:
+            logger.mailer.error(f"Connection lost after {len(results)} of {len(mails)} emails: {e}")
+            results += ["Connection lost"] * (len(mails) - len(results))
+            break
+    _close_session(server)
+    return results
+
+
+# (filename, content type, chunks of the content)
+Attachment = tuple[str, str, typing.Iterable[bytes]]
+
+# 57 raw bytes encode to one 76 characters base64 line, the MIME maximum
+_BASE64_LINE_BYTES = 57
+_SEND_BUFFER_SIZE = 64 * 1024
+
+
+def _base64_lines(chunks: typing.Iterable[bytes]) -> typing.Iterator[bytes]:
+    """
+    Base64 encode a stream of chunks into CRLF terminated lines, holding at most one chunk.
+    """
+
+    pending = b""
+    for chunk in chunks:
+        pending += chunk
+        cut = len(pending) - len(pending) % _BASE64_LINE_BYTES
+        for start in range(0, cut, _BASE64_LINE_BYTES):
+            yield base64.b64encode(pending[start:start + _BASE64_LINE_BYTES]) + b"\r\n"
+        pending = pending[cut:]
+    if pending:
+        yield base64.b64encode(pending) + b"\r\n"
+
+
+def _encode_header(value: str) -> str:
+    return value if value.isascii() else email.header.Header(value, "utf-8").encode()
+
+
+def _mime_lines(
+    from_email: str,
+    to_email: str,
+    subject: str,
+    message_body: str,
+    attachments: list[Attachment],
+) -> typing.Iterator[bytes]:
+    """
+    Generate a multipart/mixed MIME message line by line, attachments are read lazily.
+    """
+
+    boundary = f"=_{uuid.uuid4().hex}"
+    yield f"From: {from_email}\r\n".encode()
+    yield f"To: {to_email}\r\n".encode()
+    yield f"Subject: {_encode_header(subject)}\r\n".encode()
+    yield b"MIME-Version: 1.0\r\n"
+    yield f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n'.encode()
+    yield b"\r\n"
+
+    yield f"--{boundary}\r\n".encode()
+    yield b"Content-Type: text/plain; charset=utf-8\r\n"
+    yield b"Content-Transfer-Encoding: base64\r\n"
+    yield b"\r\n"
+    yield from _base64_lines([message_body.encode()])
+
+    for filename, content_type, chunks in attachments:
+        filename = _encode_header(filename).replace('"', "")
+        yield f"--{boundary}\r\n".encode()
+        yield f"Content-Type: {content_type}\r\n".encode()
+        yield f'Content-Disposition: attachment; filename="{filename}"\r\n'.encode()
+        yield b"Content-Transfer-Encoding: base64\r\n"
+        yield b"\r\n"
+        yield from _base64_lines(chunks)
+
+    yield f"--{boundary}--\r\n".encode()
+
+
+def _send_data(server: socket.socket, lines: typing.Iterable[bytes]) -> str:
+    """
+    Stream a message after DATA, dot-stuffing lines and terminating it with "<CRLF>.<CRLF>".
+
+    :return: The reply of the server.
+    """
+
+    buffer = bytearray()
+    for line in lines:
+        if line.startswith(b"."):
+            buffer += b"."
+        buffer += line
+        if len(buffer) >= _SEND_BUFFER_SIZE:
+            server.sendall(buffer)
+            buffer.clear()
+    buffer += b".\r\n"
+    server.sendall(buffer)
+
     response = server.recv(1024).decode()
     logger.mailer.info(response)
+    return response
+
+
+def send_mime(
+    from_email: str,
+    to_email: str,
+    subject: str,
+    message_body: str,
+    attachments: list[Attachment],
+) -> None:
+    """
+    Send a mail with attachments. The MIME message is encoded and written to the SMTP
+    connection incrementally, so attachments are never held in memory as a whole.
+
+    Raises RuntimeError if the server rejects the mail.
+
+    :param from_email: The sender.
+    :param to_email: The recipient.
+    :param subject: The subject.
+    :param message_body: The plain text body.
+    :param attachments: (filename, content type, chunks) of each attachment.
+    """
+
+    logger.mailer.info(
+        f"Sending email from {from_email} to {to_email} with subject {subject} and {len(attachments)} attachments"
+    )
+
+    server = _open_session()
+    in_data = False
+    try:
+        steps = [
+            (f"MAIL FROM:<{from_email}>\r\n".encode(), ("250",)),
+            (f"RCPT TO:<{to_email}>\r\n".encode(), ("250", "251")),
+            (b'DATA\r\n', ("354",)),
+        ]
+        for command, expected in steps:
+            response = _command(server, command)
+            if not response.startswith(expected):
+                raise RuntimeError(response.strip())
+
+        in_data = True
+        lines = _mime_lines(from_email, to_email, subject, message_body, attachments)
+        response = _send_data(server, lines)
+        in_data = False
+        if not response.startswith("250"):
+            raise RuntimeError(response.strip())
+    finally:
+        if in_data:
+            # the server still reads the message, QUIT would be taken as part of it:
+            # drop the connection so the unfinished mail is discarded
+            server.close()
+        else:
+            _close_session(server)
 
-    server.close()
@@ -1,23 +1,68 @@
-from app import handlers, logger, handlers, middlewares, framework
+from app import handlers, logger, handlers, middlewares, framework, repository
+from app.config import settings
 
 
 if __name__ == "__main__":
-    server = framework.Server(logger=logger.framework)
+    # preflight requests are answered by the server itself, before routing
+    cors = framework.Cors(
+        allowed_origins=settings.CORS_ALLOWED_ORIGINS,
+        max_age=settings.CORS_MAX_AGE,
+    )
+    # shed load before it piles up: per-IP rate limit and bounded in-flight requests
+    admission = framework.AdmissionControl(
+        max_in_flight=settings.MAX_IN_FLIGHT,
+        max_low_priority_in_flight=settings.MAX_LOW_PRIORITY_IN_FLIGHT,
+        ip_limiter=framework.RateLimiter(
+            settings.RATE_LIMIT_IP_RATE, settings.RATE_LIMIT_IP_BURST
+        ),
+    )
+    # TLS termination, sessions are resumed to keep the handshake cost of new connections low
+    ssl_context = None
+    if settings.TLS_CERTFILE:
+        ssl_context = framework.create_tls_context(
+            settings.TLS_CERTFILE,
+            settings.TLS_KEYFILE or None,
+            num_tickets=settings.TLS_NUM_TICKETS,
+        )
+    server = framework.AsyncServer(
+        logger=logger.framework,
+        cors=cors,
+        admission=admission,
+        max_body_size=settings.SERVER_MAX_BODY_SIZE,
+        ssl_context=ssl_context,
+        tls_handshake_timeout=settings.TLS_HANDSHAKE_TIMEOUT,
+    )
 
-    # global middleware that prevents CORS issues
-    server.router.register_middleware(middlewares.say_ok_to_preflight_requests)
+    # UI, as a fallback for every GET that is not an API route
+    if settings.STATIC_ROOT:
+        static_files = framework.StaticFiles(
+            settings.STATIC_ROOT, max_age=settings.STATIC_MAX_AGE, logger=logger.framework
+        )
+        server.router.mount("/", static_files)
 
     # public routes
     server.router.register_route("POST", "/user", handlers.create_user)
     server.router.register_route("POST", "/login", handlers.login_user)
 
+    # operational metrics (cache hit rates, write batching), meant for the operators' network only
+    if settings.METRICS_ENABLED:
+        server.router.register_route("GET", "/metrics", handlers.get_metrics)
+
     # protected routes
     server.router.register_middleware(middlewares.inject_user)
+    server.router.register_middleware(middlewares.rate_limit_user)
     server.router.register_route("GET", "/me", handlers.get_me)
 
-    # mail routes
+    # mail routes, sending is expensive and shed first under load
     server.router.register_route("GET", "/mails", handlers.get_mails)
-    server.router.register_route("POST", "/mail", handlers.send_mail)
+    server.router.register_route("GET", "/mails/search", handlers.search_mails)
+    server.router.register_route("GET", "/mails/stats", handlers.get_mail_stats)
+    server.router.register_route("GET", "/events", handlers.mail_events)
+    server.router.register_route("POST", "/mail", handlers.send_mail, low_priority=True)
+    server.router.register_route("POST", "/mails", handlers.send_mails, low_priority=True)
+
+    # built here rather than by the first search, which would block on a large collection
+    repository.create_indexes()
 
     server.bind()
     server.run()
@@ -1,19 +1,25 @@
 # Middleware = typing.Callable[["Ctx", "Request"], None]
 
 from pydantic import ValidationError
-from app.framework import Request, Ctx, Response, Status_401_UNAUTHORIZED
+from app.framework import Request, Ctx, Response, RateLimiter, Status_401_UNAUTHORIZED, Status_429_TOO_MANY_REQUESTS
 import json
 from app import models, utils, logger
+from app.config import settings
 
 
-def say_ok_to_preflight_requests(ctx: Ctx, req: Request):
-    if req.method == "OPTIONS":
-        return Response.from_text("OK")
+user_rate_limiter = RateLimiter(settings.RATE_LIMIT_USER_RATE, settings.RATE_LIMIT_USER_BURST)
+
+# EventSource cannot set headers, these routes may pass the token in the query instead
+QUERY_TOKEN_ROUTES = {"GET:/events"}
 
 
 def inject_user(ctx: Ctx, req: Request):
+    token = req.headers.get("Authorization")
+    if not token and req.get_route() in QUERY_TOKEN_ROUTES:
+        token = req.params.get("token")
+
     try:
-        _user = utils.verify_jwt(req.headers.get("Authorization"))
+        _user = utils.verify_jwt(token)
         logger.app.info(f"inject_user - User raw string: {_user}")
     except utils.InvalidToken:
         return Response.from_text("Unauthorized", status=Status_401_UNAUTHORIZED)
@@ -32,3 +38,14 @@ def inject_user(ctx: Ctx, req: Request):
         return Response.from_text("Unauthorized", status=Status_401_UNAUTHORIZED)
 
     ctx["user"] = user
+
+
+def rate_limit_user(ctx: Ctx, req: Request):
+    """
+    Rate limit authenticated users, must be registered after `inject_user`.
+    """
+
+    wait = user_rate_limiter.take(ctx["user"].id)
+    if wait:
+        logger.app.warning(f"rate_limit_user - User {ctx['user'].id} is rate limited")
+        return Response.retry_later(wait, status=Status_429_TOO_MANY_REQUESTS)
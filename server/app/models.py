@@ -2,7 +2,8 @@ from app.database import DbDumper, OptionalId, RequiredId
 from bson import ObjectId
 from typing import Annotated
 from pydantic import EmailStr, Field, SecretStr
-from app import utils
+from app import compression, utils
+from app.config import settings
 
 
 class Credentials(DbDumper):
@@ -36,14 +37,56 @@ class CreateUser(User):
         json_encoders = {ObjectId: str}
 
 
+class SendMail(DbDumper):
+    to: str
+    subject: str
+    body: str
+
+
+class SearchMails(DbDumper):
+    q: Annotated[str, Field(min_length=1, max_length=256)]
+    page: Annotated[int, Field(default=1, ge=1)]
+    per_page: Annotated[int, Field(default=20, ge=1, le=settings.MAIL_SEARCH_MAX_PER_PAGE)]
+
+
+class MailStats(DbDumper):
+    total: int = 0
+    per_day: dict[str, int] = Field(default_factory=dict)
+    per_recipient: dict[str, int] = Field(default_factory=dict)
+
+
+class Attachment(DbDumper):
+    # id of the GridFS file holding the content
+    file_id: str
+    filename: str
+    content_type: str
+    size: int
+
+
 class Mail(DbDumper):
     id: OptionalId
     to: str
     subject: str
     body: str
     user_id: RequiredId
+    attachments: list[Attachment] = Field(default_factory=list)
 
     class Config:
         populate_by_name = True
         arbitrary_types_allowed = True
         json_encoders = {ObjectId: str}
+
+    @classmethod
+    def from_trusted_db(cls, doc: dict) -> "Mail":
+        # the caller's document is left untouched, the hydrated fields go into a copy
+        fields = {
+            **doc,
+            "attachments": [
+                Attachment.model_construct(**attachment)
+                for attachment in doc.get("attachments", [])
+            ],
+        }
+        # the body is only present (and only decompressed) if the projection asked for it
+        if "body" in doc:
+            fields["body"] = compression.decompress_text(doc["body"])
+        return super().from_trusted_db(fields)
@@ -0,0 +1,6 @@
+from app import repository
+
+
+if __name__ == "__main__":
+    # backfill the mail_stats summary from the mails collection, see MongoRepository.rebuild_mail_stats
+    repository.MongoRepository().rebuild_mail_stats()
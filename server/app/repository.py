@@ -1,22 +1,261 @@
+import time
+import typing
+import asyncio
+import collections
+import functools
+import gridfs
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, WriteError
 from pymongo.collection import Collection
+from pymongo.asynchronous.collection import AsyncCollection
 from bson import ObjectId
-from app import database, logger, config
-from app.models import Mail, User
+from app import cache, compression, database, logger, config
+from app.models import Mail, MailStats, User
+
+
+# Text index scoped by user: searches must filter on user_id, so only that user's
+# entries are scanned no matter how many mails other users have.
+MAILS_SEARCH_INDEX = [
+    ("user_id", 1),
+    ("subject", "text"),
+    ("to", "text"),
+    ("body", "text"),
+]
+MAILS_SEARCH_WEIGHTS = {"subject": 5, "to": 3, "body": 1}
+
+# Bodies above the threshold are stored as binary prefixed with the codec marker.
+# The text index skips them, so such mails are only found by subject and recipient.
+MAIL_BODY_CODEC = compression.available_codec(config.settings.MAIL_BODY_COMPRESSION)
+
+
+def _escape_key(key: str) -> str:
+    # recipients are used as field names, which cannot contain "." or "$"
+    return key.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def _unescape_key(key: str) -> str:
+    return key.replace("%24", "$").replace("%2E", ".").replace("%25", "%")
+
+
+def _mail_to_db(mail: Mail) -> dict:
+    # large bodies are stored compressed, marked with their codec
+    mail_dict = Mail.to_db(mail)
+    mail_dict["body"] = compression.compress_text(
+        mail_dict["body"], MAIL_BODY_CODEC, config.settings.MAIL_BODY_COMPRESSION_THRESHOLD
+    )
+    return mail_dict
+
+
+@functools.cache
+def _mail_projection(with_body: bool) -> dict:
+    if with_body:
+        return Mail.db_projection()
+    return {key: value for key, value in Mail.db_projection().items() if key != "body"}
+
+
+def _mail_stats_updates(mail_dicts: list[dict]) -> list[UpdateOne]:
+    """
+    Build the increments of the mail_stats summary documents for newly inserted mails.
+    Mails are bucketed per UTC day of their ObjectId.
+
+    :param mail_dicts: The inserted documents, `_id` included.
+    """
+
+    increments = collections.defaultdict(collections.Counter)
+    for mail_dict in mail_dicts:
+        user_id = mail_dict["user_id"]
+        day = mail_dict["_id"].generation_time.date().isoformat()
+        increments[user_id]["total"] += 1
+        increments[user_id][f"per_day.{day}"] += 1
+        increments[user_id][f"per_recipient.{_escape_key(mail_dict['to'])}"] += 1
+
+    return [
+        UpdateOne({"_id": user_id}, {"$inc": dict(increment)}, upsert=True)
+        for user_id, increment in increments.items()
+    ]
+
+
+def _mail_stats_from_db(stats_dict: dict | None) -> MailStats:
+    if not stats_dict:
+        return MailStats()
+    return MailStats.model_construct(
+        total=stats_dict.get("total", 0),
+        per_day=stats_dict.get("per_day", {}),
+        per_recipient={
+            _unescape_key(key): count
+            for key, count in stats_dict.get("per_recipient", {}).items()
+        },
+    )
+
+
+def _connect(database_class: type[database.Database]) -> database.Database:
+    return database_class(
+        config.settings.MONGODB_URI,
+        config.settings.MONGODB_DATABASE,
+        logger=logger.db,
+        max_pool_size=config.settings.MONGODB_MAX_POOL_SIZE,
+        min_pool_size=config.settings.MONGODB_MIN_POOL_SIZE,
+        wait_queue_timeout_ms=config.settings.MONGODB_WAIT_QUEUE_TIMEOUT_MS,
+    )
+
+
+class InsertBatcher:
+    """
+    Group commit for inserts: documents queued within `max_delay` seconds of the first
+    one, up to `max_size` of them, are written with a single unordered `insert_many`.
+    Each caller gets back its own `_id`, or its own error if its document was rejected.
+    """
+
+    collection: AsyncCollection
+    max_size: int
+    max_delay: float
+    after_write: typing.Callable[[list[dict]], typing.Awaitable[None]] | None
+    flushes: int
+    inserted: int
+    failed: int
+    largest_batch: int
+    wait_time: float
+
+    _pending: list[tuple[dict, asyncio.Future, float]]
+    _timer: asyncio.TimerHandle | None
+    _writes: set[asyncio.Task]
+
+    def __init__(
+        self,
+        collection: AsyncCollection,
+        max_size: int = 100,
+        max_delay: float = 0.002,
+        after_write: typing.Callable[[list[dict]], typing.Awaitable[None]] | None = None,
+    ) -> None:
+        """
+        :param collection: The collection to insert into.
+        :param max_size: The number of queued documents that triggers a flush right away.
+        :param max_delay: The longest time in seconds a document waits for others to join
+                          its batch. 0 writes every document on its own.
+        :param after_write: Called with the inserted documents of each batch, before the
+                            callers are resumed.
+        """
+
+        self.collection = collection
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.after_write = after_write
+        self.flushes = 0
+        self.inserted = 0
+        self.failed = 0
+        self.largest_batch = 0
+        self.wait_time = 0.0
+
+        self._pending = []
+        self._timer = None
+        self._writes = set()
+
+    async def insert(self, doc: dict) -> ObjectId:
+        """
+        Queue a document and wait until its batch is written.
+
+        :param doc: The document to insert.
+
+        :return: The `_id` of the inserted document.
+        """
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((doc, future, time.monotonic()))
+
+        if len(self._pending) >= self.max_size or self.max_delay <= 0:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_delay, self._flush)
+
+        # a cancelled caller does not cancel the write, the document is inserted anyway
+        return await asyncio.shield(future)
+
+    def stats(self) -> dict[str, float]:
+        """
+        Get the write metrics of the batcher.
+
+        :return: A dictionary with the number of flushes, inserted and failed documents,
+                 the largest and mean batch sizes and the mean time spent queued (ms).
+        """
+
+        written = self.inserted + self.failed
+        return {
+            "flushes": self.flushes,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "pending": len(self._pending),
+            "largest_batch": self.largest_batch,
+            "mean_batch": written / self.flushes if self.flushes else 0.0,
+            "mean_wait_ms": self.wait_time * 1000 / written if written else 0.0,
+        }
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._write(batch))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    async def _write(self, batch: list[tuple[dict, asyncio.Future, float]]) -> None:
+        started_at = time.monotonic()
+        docs = [doc for doc, _, _ in batch]
+        errors: dict[int, Exception] = {}
+
+        try:
+            # insert_many sets the _id of every document before sending them
+            await self.collection.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get("writeErrors", []):
+                errors[error["index"]] = WriteError(error["errmsg"], error["code"], error)
+            if not errors:
+                errors = dict.fromkeys(range(len(batch)), e)
+        except Exception as e:
+            errors = dict.fromkeys(range(len(batch)), e)
+
+        written = [doc for i, doc in enumerate(docs) if i not in errors]
+        if written and self.after_write is not None:
+            try:
+                await self.after_write(written)
+            except Exception as e:
+                logger.db.error(f"InsertBatcher - after_write failed: {e}")
+
+        self.flushes += 1
+        self.inserted += len(written)
+        self.failed += len(errors)
+        self.largest_batch = max(self.largest_batch, len(batch))
+        self.wait_time += sum(started_at - queued_at for _, _, queued_at in batch)
+        logger.db.debug(f"InsertBatcher - {self.collection.name}: {self.stats()}")
+
+        for i, (doc, future, _) in enumerate(batch):
+            if future.done():
+                continue
+            if i in errors:
+                future.set_exception(errors[i])
+            else:
+                future.set_result(doc["_id"])
 
 
 class MongoRepository:
     db: database.Database
     users_collection: Collection
     mails_collection: Collection
+    mailbox_versions: cache.VersionCounter
+    stats_collection: Collection
+    attachments_bucket: gridfs.GridFSBucket
 
     def __init__(self):
-        self.db = database.Database(
-            config.settings.MONGODB_URI,
-            config.settings.MONGODB_DATABASE,
-            logger=logger.db,
-        )
+        self.db = _connect(database.Database)
         self.users_collection = self.db.get_collection("users")
         self.mails_collection = self.db.get_collection("mails")
+        self.stats_collection = self.db.get_collection("mail_stats")
+        self.attachments_bucket = gridfs.GridFSBucket(self.db.db, bucket_name="attachments")
+        # bumped by the mail writes of this process, used as the ETag of GET /mails
+        self.mailbox_versions = cache.VersionCounter()
 
     def create_user(self, user: User) -> User:
         user_dict = User.to_db(user)
@@ -25,29 +264,391 @@ class MongoRepository:
         return user
 
     def get_user(self, filter: dict) -> User:
-        user_dict = self.users_collection.find_one(filter)
+        user_dict = self.users_collection.find_one(filter, User.db_projection())
         if user_dict:
-            return User(**User.from_db(user_dict))
+            return User.from_trusted_db(user_dict)
         return None
 
     def get_users(self) -> list[User]:
-        users_dict = self.users_collection.find()
-        users = [User(**User.from_db(user_dict)) for user_dict in users_dict]
+        users_dict = self.users_collection.find({}, User.db_projection())
+        users = [User.from_trusted_db(user_dict) for user_dict in users_dict]
         return users
 
     def create_mail(self, mail: Mail) -> Mail:
-        mail_dict = Mail.to_db(mail)
+        mail_dict = _mail_to_db(mail)
         result = self.mails_collection.insert_one(mail_dict)
         mail.id = str(result.inserted_id)
+        self._update_mail_stats([mail_dict])
+        self.mailbox_versions.bump(mail.user_id)
         return mail
 
-    def get_mails_by_user_id(self, user_id: str) -> list[Mail]:
-        mails_dict = self.mails_collection.find({"user_id": ObjectId(user_id)})
-        mails = [Mail(**Mail.from_db(mail_dict)) for mail_dict in mails_dict]
+    def create_mails(self, mails: list[Mail]) -> list[Mail]:
+        mail_dicts = [_mail_to_db(mail) for mail in mails]
+        result = self.mails_collection.insert_many(mail_dicts)
+        for mail, inserted_id in zip(mails, result.inserted_ids):
+            mail.id = str(inserted_id)
+        self._update_mail_stats(mail_dicts)
+        for user_id in {mail.user_id for mail in mails}:
+            self.mailbox_versions.bump(user_id)
+        return mails
+
+    def _update_mail_stats(self, mail_dicts: list[dict]) -> None:
+        # the mails are stored already: a failed counter update must not fail the send,
+        # the counters can be recomputed with `rebuild_mail_stats`
+        try:
+            self.stats_collection.bulk_write(_mail_stats_updates(mail_dicts), ordered=False)
+        except Exception as e:
+            logger.db.error(f"mail_stats update failed: {e}")
+
+    def get_mails_by_user_id(self, user_id: str, with_body: bool = True) -> list[Mail]:
+        mails_dict = self.mails_collection.find(
+            {"user_id": ObjectId(user_id)}, _mail_projection(with_body)
+        )
+        mails = [Mail.from_trusted_db(mail_dict) for mail_dict in mails_dict]
         return mails
 
+    def create_indexes(self) -> None:
+        """
+        Create the indexes the queries rely on. A no-op for the indexes that already exist,
+        but building the text index over a large mails collection takes a while.
+        """
+
+        self.mails_collection.create_index(
+            MAILS_SEARCH_INDEX, name="mails_search", weights=MAILS_SEARCH_WEIGHTS
+        )
+
+    def search_mails(
+        self, user_id: str, query: str, skip: int = 0, limit: int = 20
+    ) -> list[tuple[Mail, float]]:
+        mails_dict = (
+            self.mails_collection.find(
+                {"user_id": ObjectId(user_id), "$text": {"$search": query}},
+                {**Mail.db_projection(), "score": {"$meta": "textScore"}},
+            )
+            .sort({"score": {"$meta": "textScore"}})
+            .skip(skip)
+            .limit(limit)
+        )
+        return [
+            (Mail.from_trusted_db(mail_dict), mail_dict["score"])
+            for mail_dict in mails_dict
+        ]
+
+    def get_mail_stats(self, user_id: str) -> MailStats:
+        stats_dict = self.stats_collection.find_one({"_id": ObjectId(user_id)})
+        return _mail_stats_from_db(stats_dict)
+
+    def rebuild_mail_stats(self) -> None:
+        """
+        Recompute the mail_stats summary of every user from the mails collection.
+        Only needed to backfill mails sent before the counters existed.
+        """
+
+        stats = collections.defaultdict(collections.Counter)
+        pipeline = [
+            {
+                "$group": {
+                    "_id": {
+                        "user_id": "$user_id",
+                        "day": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$toDate": "$_id"}}},
+                        "to": "$to",
+                    },
+                    "count": {"$sum": 1},
+                }
+            }
+        ]
+        for group in self.mails_collection.aggregate(pipeline):
+            user_stats = stats[group["_id"]["user_id"]]
+            user_stats["total"] += group["count"]
+            user_stats[("per_day", group["_id"]["day"])] += group["count"]
+            user_stats[("per_recipient", _escape_key(group["_id"]["to"]))] += group["count"]
+
+        for user_id, user_stats in stats.items():
+            stats_dict = {"total": user_stats.pop("total"), "per_day": {}, "per_recipient": {}}
+            for (field, key), count in user_stats.items():
+                stats_dict[field][key] = count
+            self.stats_collection.replace_one({"_id": user_id}, stats_dict, upsert=True)
+        logger.db.info(f"rebuild_mail_stats - Rebuilt stats of {len(stats)} users")
+
+    def open_attachment_upload(self, filename: str, content_type: str) -> gridfs.GridIn:
+        return self.attachments_bucket.open_upload_stream(
+            filename, metadata={"content_type": content_type}
+        )
+
+    def open_attachment(self, file_id: str) -> gridfs.GridOut:
+        return self.attachments_bucket.open_download_stream(ObjectId(file_id))
+
+    def delete_attachment(self, file_id: str) -> None:
+        self.attachments_bucket.delete(ObjectId(file_id))
+
     def get_mail(self, mail_id: str) -> Mail:
-        mail_dict = self.mails_collection.find_one({"_id": ObjectId(mail_id)})
+        mail_dict = self.mails_collection.find_one(
+            {"_id": ObjectId(mail_id)}, Mail.db_projection()
+        )
+        if mail_dict:
+            return Mail.from_trusted_db(mail_dict)
+        return None
+
+
+class _UserCache:
+    """
+    Read-through cache state shared by the cached repositories.
+
+    `get_user` results are cached per filter (including misses), and `get_users`
+    keeps a snapshot of the whole collection. Both are invalidated by `create_user`.
+    A read that was in flight during an invalidation is not cached, it may be stale.
+    """
+
+    user_cache: cache.TTLCache
+    users_snapshot: cache.TTLCache
+    generation: int
+
+    def _init_cache(self) -> None:
+        self.generation = 0
+        self.user_cache = cache.TTLCache(
+            max_size=config.settings.USER_CACHE_MAX_SIZE,
+            ttl=config.settings.USER_CACHE_TTL,
+        )
+        self.users_snapshot = cache.TTLCache(
+            max_size=1,
+            ttl=config.settings.USER_CACHE_TTL,
+        )
+
+    @staticmethod
+    def _filter_key(filter: dict) -> str:
+        return repr(sorted(filter.items()))
+
+    def _invalidate_users(self) -> None:
+        self.generation += 1
+        self.user_cache.clear()
+        self.users_snapshot.clear()
+
+    def cache_stats(self) -> dict[str, dict[str, int]]:
+        return {
+            "user": self.user_cache.stats(),
+            "users": self.users_snapshot.stats(),
+        }
+
+
+class CachedMongoRepository(_UserCache, MongoRepository):
+    def __init__(self):
+        super().__init__()
+        self._init_cache()
+
+    def create_user(self, user: User) -> User:
+        user = super().create_user(user)
+        self._invalidate_users()
+        return user
+
+    def get_user(self, filter: dict) -> User:
+        key = self._filter_key(filter)
+        user = self.user_cache.get(key, cache.MISSING)
+        if user is cache.MISSING:
+            generation = self.generation
+            user = super().get_user(filter)
+            if generation == self.generation:
+                self.user_cache.set(key, user)
+            logger.db.debug(f"get_user - cache miss: {self.user_cache.stats()}")
+        return user.model_copy() if user else None
+
+    def get_users(self) -> list[User]:
+        users = self.users_snapshot.get("users")
+        if users is None:
+            generation = self.generation
+            users = super().get_users()
+            if generation == self.generation:
+                self.users_snapshot.set("users", users)
+            logger.db.debug(f"get_users - cache miss: {self.users_snapshot.stats()}")
+        return [user.model_copy() for user in users]
+
+
+class AsyncMongoRepository:
+    """
+    MongoRepository for the event-loop server, every method is a coroutine.
+    """
+
+    db: database.AsyncDatabase
+    users_collection: AsyncCollection
+    mails_collection: AsyncCollection
+    mailbox_versions: cache.VersionCounter
+    stats_collection: AsyncCollection
+    attachments_bucket: gridfs.AsyncGridFSBucket
+    users_batcher: InsertBatcher
+    mails_batcher: InsertBatcher
+
+    def __init__(self):
+        self.db = _connect(database.AsyncDatabase)
+        self.users_collection = self.db.get_collection("users")
+        self.mails_collection = self.db.get_collection("mails")
+        self.stats_collection = self.db.get_collection("mail_stats")
+        self.attachments_bucket = gridfs.AsyncGridFSBucket(self.db.db, bucket_name="attachments")
+        # bumped by the mail writes of this process, used as the ETag of GET /mails
+        self.mailbox_versions = cache.VersionCounter()
+
+        # concurrent single inserts are coalesced into one round trip per batch
+        batch_max_size = config.settings.MONGODB_WRITE_BATCH_MAX_SIZE
+        batch_max_delay = config.settings.MONGODB_WRITE_BATCH_DELAY_MS / 1000
+        self.users_batcher = InsertBatcher(
+            self.users_collection, batch_max_size, batch_max_delay
+        )
+        self.mails_batcher = InsertBatcher(
+            self.mails_collection, batch_max_size, batch_max_delay, self._update_mail_stats
+        )
+
+    def write_stats(self) -> dict[str, dict[str, float]]:
+        return {
+            "users": self.users_batcher.stats(),
+            "mails": self.mails_batcher.stats(),
+        }
+
+    async def create_user(self, user: User) -> User:
+        user_dict = User.to_db(user)
+        user.id = str(await self.users_batcher.insert(user_dict))
+        return user
+
+    async def get_user(self, filter: dict) -> User:
+        user_dict = await self.users_collection.find_one(filter, User.db_projection())
+        if user_dict:
+            return User.from_trusted_db(user_dict)
+        return None
+
+    async def get_users(self) -> list[User]:
+        users_dict = self.users_collection.find({}, User.db_projection())
+        users = [User.from_trusted_db(user_dict) async for user_dict in users_dict]
+        return users
+
+    async def create_mail(self, mail: Mail) -> Mail:
+        mail_dict = _mail_to_db(mail)
+        # the mail_stats increments are written once per batch by _update_mail_stats
+        mail.id = str(await self.mails_batcher.insert(mail_dict))
+        self.mailbox_versions.bump(mail.user_id)
+        return mail
+
+    async def create_mails(self, mails: list[Mail]) -> list[Mail]:
+        mail_dicts = [_mail_to_db(mail) for mail in mails]
+        result = await self.mails_collection.insert_many(mail_dicts)
+        for mail, inserted_id in zip(mails, result.inserted_ids):
+            mail.id = str(inserted_id)
+        await self._update_mail_stats(mail_dicts)
+        for user_id in {mail.user_id for mail in mails}:
+            self.mailbox_versions.bump(user_id)
+        return mails
+
+    async def _update_mail_stats(self, mail_dicts: list[dict]) -> None:
+        # the mails are stored already: a failed counter update must not fail the send,
+        # the counters can be recomputed with `rebuild_mail_stats`
+        try:
+            await self.stats_collection.bulk_write(_mail_stats_updates(mail_dicts), ordered=False)
+        except Exception as e:
+            logger.db.error(f"mail_stats update failed: {e}")
+
+    async def get_mails_by_user_id(self, user_id: str, with_body: bool = True) -> list[Mail]:
+        mails_dict = self.mails_collection.find(
+            {"user_id": ObjectId(user_id)}, _mail_projection(with_body)
+        )
+        mails = [Mail.from_trusted_db(mail_dict) async for mail_dict in mails_dict]
+        return mails
+
+    async def search_mails(
+        self, user_id: str, query: str, skip: int = 0, limit: int = 20
+    ) -> list[tuple[Mail, float]]:
+        mails_dict = (
+            self.mails_collection.find(
+                {"user_id": ObjectId(user_id), "$text": {"$search": query}},
+                {**Mail.db_projection(), "score": {"$meta": "textScore"}},
+            )
+            .sort({"score": {"$meta": "textScore"}})
+            .skip(skip)
+            .limit(limit)
+        )
+        return [
+            (Mail.from_trusted_db(mail_dict), mail_dict["score"])
+            async for mail_dict in mails_dict
+        ]
+
+    async def get_mail_stats(self, user_id: str) -> MailStats:
+        stats_dict = await self.stats_collection.find_one({"_id": ObjectId(user_id)})
+        return _mail_stats_from_db(stats_dict)
+
+    def open_attachment_upload(self, filename: str, content_type: str) -> gridfs.AsyncGridIn:
+        return self.attachments_bucket.open_upload_stream(
+            filename, metadata={"content_type": content_type}
+        )
+
+    async def open_attachment(self, file_id: str) -> gridfs.AsyncGridOut:
+        return await self.attachments_bucket.open_download_stream(ObjectId(file_id))
+
+    async def delete_attachment(self, file_id: str) -> None:
+        await self.attachments_bucket.delete(ObjectId(file_id))
+
+    async def get_mail(self, mail_id: str) -> Mail:
+        mail_dict = await self.mails_collection.find_one(
+            {"_id": ObjectId(mail_id)}, Mail.db_projection()
+        )
         if mail_dict:
-            return Mail(**Mail.from_db(mail_dict))
+            return Mail.from_trusted_db(mail_dict)
         return None
+
+
+class AsyncCachedMongoRepository(_UserCache, AsyncMongoRepository):
+    def __init__(self):
+        super().__init__()
+        self._init_cache()
+
+    async def create_user(self, user: User) -> User:
+        user = await super().create_user(user)
+        self._invalidate_users()
+        return user
+
+    async def get_user(self, filter: dict) -> User:
+        key = self._filter_key(filter)
+        user = self.user_cache.get(key, cache.MISSING)
+        if user is cache.MISSING:
+            generation = self.generation
+            user = await super().get_user(filter)
+            if generation == self.generation:
+                self.user_cache.set(key, user)
+            logger.db.debug(f"get_user - cache miss: {self.user_cache.stats()}")
+        return user.model_copy() if user else None
+
+    async def get_users(self) -> list[User]:
+        users = self.users_snapshot.get("users")
+        if users is None:
+            generation = self.generation
+            users = await super().get_users()
+            if generation == self.generation:
+                self.users_snapshot.set("users", users)
+            logger.db.debug(f"get_users - cache miss: {self.users_snapshot.stats()}")
+        return [user.model_copy() for user in users]
+
+
+def create_repository() -> MongoRepository:
+    """
+    Create a blocking repository, honoring the USER_CACHE_ENABLED switch.
+    """
+
+    if config.settings.USER_CACHE_ENABLED:
+        return CachedMongoRepository()
+    return MongoRepository()
+
+
+def create_indexes() -> None:
+    """
+    Create the indexes with a short-lived blocking connection, before serving requests.
+    """
+
+    repo = MongoRepository()
+    try:
+        repo.create_indexes()
+    finally:
+        repo.db.client.close()
+
+
+def create_async_repository() -> AsyncMongoRepository:
+    """
+    Create the repository used by the handlers, honoring the USER_CACHE_ENABLED switch.
+    """
+
+    if config.settings.USER_CACHE_ENABLED:
+        return AsyncCachedMongoRepository()
+    return AsyncMongoRepository()
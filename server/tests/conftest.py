@@ -0,0 +1,26 @@
+import os
+import tempfile
+
+# Settings are read when the app package is imported, provide the required ones.
+os.environ.setdefault("MONGODB_URI", "mongodb://localhost:27017")
+os.environ.setdefault("MAIL_USERNAME", "test")
+os.environ.setdefault("MAIL_PASSWORD", "test")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("LOG_FILENAME", os.path.join(tempfile.gettempdir(), "server-tests.log"))
+
+import pytest
+
+from app import repository
+from tests import stand_in
+
+
+@pytest.fixture
+def stand_in_db(monkeypatch) -> stand_in.AsyncDatabase:
+    """
+    Make the async repositories use the in-process stand-in instead of MongoDB.
+    """
+
+    db = stand_in.AsyncDatabase()
+    monkeypatch.setattr(repository, "_connect", lambda database_class: db)
+    monkeypatch.setattr(repository.gridfs, "AsyncGridFSBucket", lambda *args, **kwargs: None)
+    return db
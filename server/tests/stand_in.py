@@ -0,0 +1,140 @@
+"""
+In-process stand-in for the parts of pymongo's async API used by AsyncMongoRepository.
+Only equality filters, the `db_projection` projections and `$inc` upserts are supported.
+"""
+
+import copy
+import collections
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+
+def _project(doc: dict, projection: dict | None) -> dict:
+    if projection is None:
+        return copy.deepcopy(doc)
+
+    projected = {}
+    for key, spec in projection.items():
+        if spec == 0:
+            continue
+        if isinstance(spec, dict) and "$toString" in spec:
+            value = doc.get(spec["$toString"].lstrip("$"))
+            if value is not None:
+                projected[key] = str(value)
+        elif key in doc:
+            projected[key] = copy.deepcopy(doc[key])
+    return projected
+
+
+def _matches(doc: dict, filter: dict) -> bool:
+    return all(doc.get(key) == value for key, value in filter.items())
+
+
+class AsyncCursor:
+    def __init__(self, docs: list[dict]) -> None:
+        self.docs = docs
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for doc in self.docs:
+            yield doc
+
+
+class AsyncCollection:
+    name: str
+    docs: list[dict]
+    unique: tuple[str, ...]
+    calls: collections.Counter
+    fail_bulk_write: bool
+
+    def __init__(self, name: str, unique: tuple[str, ...] = ()) -> None:
+        """
+        :param name: The name of the collection.
+        :param unique: Fields with a unique index, inserting a duplicate is a write error.
+        """
+
+        self.name = name
+        self.docs = []
+        self.unique = unique
+        self.calls = collections.Counter()
+        self.fail_bulk_write = False
+
+    def _is_duplicate(self, doc: dict) -> bool:
+        return any(
+            field in doc and doc[field] == other.get(field)
+            for field in self.unique
+            for other in self.docs
+        )
+
+    async def insert_one(self, doc: dict):
+        self.calls["insert_one"] += 1
+        result = await self.insert_many([doc])
+        result.inserted_id = result.inserted_ids[0]
+        return result
+
+    async def insert_many(self, docs: list[dict], ordered: bool = True):
+        self.calls["insert_many"] += 1
+        errors = []
+        for index, doc in enumerate(docs):
+            doc.setdefault("_id", ObjectId())
+            if self._is_duplicate(doc):
+                errors.append({"index": index, "code": 11000, "errmsg": "E11000 duplicate key"})
+                if ordered:
+                    break
+                continue
+            self.docs.append(copy.deepcopy(doc))
+
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, "nInserted": len(docs) - len(errors)})
+
+        class InsertManyResult:
+            inserted_ids = [doc["_id"] for doc in docs]
+
+        return InsertManyResult()
+
+    async def find_one(self, filter: dict, projection: dict | None = None) -> dict | None:
+        self.calls["find_one"] += 1
+        for doc in self.docs:
+            if _matches(doc, filter):
+                return _project(doc, projection)
+        return None
+
+    def find(self, filter: dict, projection: dict | None = None) -> AsyncCursor:
+        self.calls["find"] += 1
+        return AsyncCursor([_project(doc, projection) for doc in self.docs if _matches(doc, filter)])
+
+    async def bulk_write(self, requests: list, ordered: bool = True) -> None:
+        self.calls["bulk_write"] += 1
+        if self.fail_bulk_write:
+            raise ConnectionError("bulk_write failed")
+
+        for request in requests:
+            doc = next((doc for doc in self.docs if _matches(doc, request._filter)), None)
+            if doc is None:
+                doc = copy.deepcopy(request._filter)
+                self.docs.append(doc)
+            for path, increment in request._doc["$inc"].items():
+                *parents, leaf = path.split(".")
+                target = doc
+                for parent in parents:
+                    target = target.setdefault(parent, {})
+                target[leaf] = target.get(leaf, 0) + increment
+
+
+class AsyncDatabase:
+    """
+    Stands in for `database.AsyncDatabase`, collections are created on first use.
+    """
+
+    collections: dict[str, AsyncCollection]
+
+    def __init__(self) -> None:
+        self.db = None
+        self.collections = {"users": AsyncCollection("users", unique=("username",))}
+
+    def get_collection(self, collection_name: str) -> AsyncCollection:
+        if collection_name not in self.collections:
+            self.collections[collection_name] = AsyncCollection(collection_name)
+        return self.collections[collection_name]
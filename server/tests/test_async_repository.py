@@ -0,0 +1,152 @@
+import asyncio
+import pytest
+from bson import ObjectId
+from pymongo.errors import WriteError
+
+from app import repository
+from app.models import Mail, User
+
+
+def _user(username: str) -> User:
+    return User(username=username, email=f"{username}@example.com", hashed_password="hashed")
+
+
+def _mail(user_id: str, body: str = "Hello") -> Mail:
+    return Mail(user_id=user_id, to="someone@example.com", subject="Hi", body=body)
+
+
+def test_create_and_get_user(stand_in_db):
+    async def scenario():
+        repo = repository.AsyncMongoRepository()
+        user = await repo.create_user(_user("alice"))
+        found = await repo.get_user({"username": "alice"})
+        users = await repo.get_users()
+        missing = await repo.get_user({"username": "bob"})
+        return user, found, users, missing
+
+    user, found, users, missing = asyncio.run(scenario())
+
+    assert len(user.id) == 24
+    assert found.id == user.id
+    assert found.email == "alice@example.com"
+    assert [u.username for u in users] == ["alice"]
+    assert missing is None
+
+
+def test_concurrent_create_mail_is_written_in_one_batch(stand_in_db):
+    user_id = str(ObjectId())
+
+    async def scenario():
+        repo = repository.AsyncMongoRepository()
+        mails = await asyncio.gather(*[repo.create_mail(_mail(user_id)) for _ in range(5)])
+        return repo, mails
+
+    repo, mails = asyncio.run(scenario())
+
+    mails_collection = stand_in_db.get_collection("mails")
+    stats_collection = stand_in_db.get_collection("mail_stats")
+    assert mails_collection.calls["insert_many"] == 1
+    assert len({mail.id for mail in mails}) == 5
+    assert stats_collection.calls["bulk_write"] == 1
+    assert stats_collection.docs[0]["total"] == 5
+    assert repo.write_stats()["mails"]["inserted"] == 5
+    assert repo.mailbox_versions.get(user_id).endswith("-5")
+
+
+def test_duplicate_user_fails_only_its_caller(stand_in_db):
+    async def scenario():
+        repo = repository.AsyncMongoRepository()
+        await repo.create_user(_user("alice"))
+        return await asyncio.gather(
+            repo.create_user(_user("bob")),
+            repo.create_user(_user("alice")),
+            repo.create_user(_user("carol")),
+            return_exceptions=True,
+        )
+
+    bob, alice, carol = asyncio.run(scenario())
+
+    assert isinstance(alice, WriteError)
+    assert alice.code == 11000
+    assert len(bob.id) == 24
+    assert len(carol.id) == 24
+
+
+def test_large_bodies_are_compressed_and_read_back(stand_in_db):
+    user_id = str(ObjectId())
+    large_body = "Lorem ipsum dolor sit amet. " * 200
+
+    async def scenario():
+        repo = repository.AsyncMongoRepository()
+        await repo.create_mails([_mail(user_id, "short"), _mail(user_id, large_body)])
+        return (
+            await repo.get_mails_by_user_id(user_id),
+            await repo.get_mails_by_user_id(user_id, with_body=False),
+        )
+
+    with_body, without_body = asyncio.run(scenario())
+
+    stored = [doc["body"] for doc in stand_in_db.get_collection("mails").docs]
+    assert stored[0] == "short"
+    assert isinstance(stored[1], bytes)
+    assert len(stored[1]) < len(large_body)
+    assert [mail.body for mail in with_body] == ["short", large_body]
+    assert all("body" not in mail.model_dump(exclude={"body"}) for mail in without_body)
+    assert all(not hasattr(mail, "body") for mail in without_body)
+
+
+def test_failed_stats_update_does_not_fail_create_mails(stand_in_db):
+    user_id = str(ObjectId())
+    stand_in_db.get_collection("mail_stats").fail_bulk_write = True
+
+    async def scenario():
+        repo = repository.AsyncMongoRepository()
+        return await repo.create_mails([_mail(user_id), _mail(user_id)])
+
+    mails = asyncio.run(scenario())
+
+    assert all(len(mail.id) == 24 for mail in mails)
+    assert len(stand_in_db.get_collection("mails").docs) == 2
+
+
+def test_cached_repository_does_not_cache_reads_that_raced_a_write(stand_in_db, monkeypatch):
+    users_collection = stand_in_db.get_collection("users")
+    find_one = users_collection.find_one
+
+    async def slow_find_one(filter, projection=None):
+        # the document is read before the concurrent insert, the result arrives after it
+        doc = await find_one(filter, projection)
+        await asyncio.sleep(0.01)
+        return doc
+
+    monkeypatch.setattr(users_collection, "find_one", slow_find_one)
+
+    async def scenario():
+        repo = repository.AsyncCachedMongoRepository()
+        stale, _ = await asyncio.gather(
+            repo.get_user({"username": "bob"}),
+            repo.create_user(_user("bob")),
+        )
+        return stale, await repo.get_user({"username": "bob"})
+
+    stale, fresh = asyncio.run(scenario())
+
+    assert stale is None
+    assert fresh is not None
+    assert fresh.username == "bob"
+
+
+def test_cached_repository_serves_repeated_reads_from_cache(stand_in_db):
+    async def scenario():
+        repo = repository.AsyncCachedMongoRepository()
+        await repo.create_user(_user("alice"))
+        first = await repo.get_user({"username": "alice"})
+        second = await repo.get_user({"username": "alice"})
+        return repo, first, second
+
+    repo, first, second = asyncio.run(scenario())
+
+    assert first == second
+    assert first is not second
+    assert stand_in_db.get_collection("users").calls["find_one"] == 1
+    assert repo.cache_stats()["user"]["hits"] == 1
@@ -0,0 +1,262 @@
+import json
+import asyncio
+import contextlib
+import logging
+
+from app import framework
+from app.framework import Response, Request, Ctx
+
+
+@contextlib.asynccontextmanager
+async def running(server: framework.AsyncServer):
+    """
+    Serve on an ephemeral port for the duration of the block, yielding the port.
+    """
+
+    server.bind()
+    task = asyncio.create_task(server.serve())
+    try:
+        yield server.server_socket.getsockname()[1]
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        server.server_socket.close()
+
+
+def make_server(**kwargs) -> framework.AsyncServer:
+    server = framework.AsyncServer(server_port=0, logger=logging.getLogger("tests"), **kwargs)
+    # the router is a class attribute, give every test its own
+    server.router = framework.Router()
+    return server
+
+
+async def request(port: int, raw: bytes) -> tuple[str, dict[str, str], bytes]:
+    """
+    Send a raw request and read the response until the server closes the connection.
+
+    :return: The status line, the headers and the body.
+    """
+
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(raw)
+    await writer.drain()
+    writer.write_eof()
+    response = await asyncio.wait_for(reader.read(), timeout=5)
+    writer.close()
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode().split("\r\n")
+    headers = dict(line.split(": ", 1) for line in header_lines)
+    return status_line, headers, body
+
+
+def http(method: str, path: str, body: bytes = b"", headers: dict[str, str] | None = None) -> bytes:
+    head = f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+    for key, value in (headers or {}).items():
+        head += f"{key}: {value}\r\n"
+    if body:
+        head += f"Content-Length: {len(body)}\r\n"
+    return head.encode() + b"\r\n" + body
+
+
+def test_routes_the_request_and_applies_cors():
+    server = make_server(cors=framework.Cors(allowed_origins=["http://localhost:3000"]))
+    server.router.register_route(
+        "GET", "/hello", lambda ctx, req: Response.from_json({"name": req.params.get("name")})
+    )
+
+    async def scenario():
+        async with running(server) as port:
+            return await request(
+                port, http("GET", "/hello?name=alice", headers={"Origin": "http://localhost:3000"})
+            )
+
+    status, headers, body = asyncio.run(scenario())
+
+    assert status == "HTTP/1.1 200 OK"
+    assert json.loads(body) == {"name": "alice"}
+    assert headers["Access-Control-Allow-Origin"] == "http://localhost:3000"
+    assert "Origin" in headers["Vary"]
+
+
+def test_unknown_route_is_not_found():
+    server = make_server()
+
+    async def scenario():
+        async with running(server) as port:
+            return await request(port, http("GET", "/nowhere"))
+
+    status, _, _ = asyncio.run(scenario())
+
+    assert status == "HTTP/1.1 404 Not Found"
+
+
+def test_answers_preflight_without_routing():
+    server = make_server()
+    calls = []
+    server.router.register_route("POST", "/mail", lambda ctx, req: calls.append(req))
+
+    async def scenario():
+        async with running(server) as port:
+            return await request(
+                port,
+                http(
+                    "OPTIONS",
+                    "/mail",
+                    headers={"Origin": "http://example.com", "Access-Control-Request-Method": "POST"},
+                ),
+            )
+
+    status, headers, _ = asyncio.run(scenario())
+
+    assert status == "HTTP/1.1 204 No Content"
+    assert "POST" in headers["Access-Control-Allow-Methods"]
+    assert calls == []
+
+
+def test_awaits_async_middlewares_and_handlers():
+    server = make_server()
+
+    async def authenticate(ctx: Ctx, req: Request):
+        await asyncio.sleep(0)
+        if req.headers.get("Authorization") != "secret":
+            return Response.from_text("Unauthorized", status=framework.Status_401_UNAUTHORIZED)
+        ctx["user"] = "alice"
+
+    async def whoami(ctx: Ctx, req: Request) -> Response:
+        await asyncio.sleep(0)
+        return Response.from_text(ctx["user"])
+
+    server.router.register_middleware(authenticate)
+    server.router.register_route("GET", "/me", whoami)
+
+    async def scenario():
+        async with running(server) as port:
+            return (
+                await request(port, http("GET", "/me")),
+                await request(port, http("GET", "/me", headers={"Authorization": "secret"})),
+            )
+
+    (denied, _, _), (allowed, _, body) = asyncio.run(scenario())
+
+    assert denied == "HTTP/1.1 401 Unauthorized"
+    assert allowed == "HTTP/1.1 200 OK"
+    assert body == b"alice"
+
+
+def test_reads_json_bodies_and_rejects_oversized_ones():
+    server = make_server(max_body_size=64)
+    server.router.register_route("POST", "/echo", lambda ctx, req: Response.from_json(req.body))
+
+    async def scenario():
+        async with running(server) as port:
+            small = json.dumps({"to": "bob"}).encode()
+            large = json.dumps({"body": "x" * 100}).encode()
+            headers = {"Content-Type": "application/json"}
+            return (
+                await request(port, http("POST", "/echo", small, headers)),
+                await request(port, http("POST", "/echo", large, headers)),
+            )
+
+    (accepted, _, body), (rejected, _, _) = asyncio.run(scenario())
+
+    assert accepted == "HTTP/1.1 200 OK"
+    assert json.loads(body) == {"to": "bob"}
+    assert rejected == "HTTP/1.1 413 Payload Too Large"
+
+
+def test_sheds_requests_over_the_in_flight_limit():
+    server = make_server(admission=framework.AdmissionControl(max_in_flight=1, retry_after=2))
+    release = asyncio.Event()
+
+    async def slow(ctx: Ctx, req: Request) -> Response:
+        await release.wait()
+        return Response.from_text("done")
+
+    server.router.register_route("GET", "/slow", slow)
+
+    async def scenario():
+        async with running(server) as port:
+            first = asyncio.create_task(request(port, http("GET", "/slow")))
+            await asyncio.sleep(0.05)
+            second = await request(port, http("GET", "/slow"))
+            release.set()
+            return await first, second
+
+    (first, _, body), (second, headers, _) = asyncio.run(scenario())
+
+    assert first == "HTTP/1.1 200 OK"
+    assert body == b"done"
+    assert second == "HTTP/1.1 503 Service Unavailable"
+    assert headers["Retry-After"] == "2"
+
+
+def test_streams_multipart_parts_to_the_handler():
+    server = make_server(max_body_size=16)
+
+    async def upload(ctx: Ctx, req: Request) -> Response:
+        parts = []
+        async for part in req.multipart:
+            size = 0
+            while chunk := await part.read_chunk():
+                size += len(chunk)
+            parts.append({"name": part.name, "filename": part.filename, "size": size})
+        return Response.from_json(parts)
+
+    server.router.register_route("POST", "/upload", upload)
+
+    boundary = "testboundary"
+    content = b"\r\n--not-the-boundary\r\n" + bytes(range(256)) * 400
+    body = (
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="subject"\r\n\r\n'
+        "Hello\r\n"
+        f"--{boundary}\r\n"
+        'Content-Disposition: form-data; name="file"; filename="data.bin"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+
+    async def scenario():
+        async with running(server) as port:
+            headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+            return await request(port, http("POST", "/upload", body, headers))
+
+    status, _, response_body = asyncio.run(scenario())
+
+    assert status == "HTTP/1.1 200 OK"
+    assert json.loads(response_body) == [
+        {"name": "subject", "filename": None, "size": 5},
+        {"name": "file", "filename": "data.bin", "size": len(content)},
+    ]
+
+
+def test_sends_streaming_responses_chunk_by_chunk():
+    server = make_server()
+
+    async def chunks():
+        for index in range(3):
+            await asyncio.sleep(0)
+            yield f"data: {index}\n\n".encode()
+
+    def stream(ctx: Ctx, req: Request) -> Response:
+        res = Response(body="", status=framework.Status_200_OK, content_type="text/event-stream")
+        res.stream = chunks()
+        return res
+
+    server.router.register_route("GET", "/events", stream)
+
+    async def scenario():
+        async with running(server) as port:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(http("GET", "/events"))
+            await writer.drain()
+            response = await asyncio.wait_for(reader.read(), timeout=5)
+            writer.close()
+            return response
+
+    response = asyncio.run(scenario())
+
+    head, _, body = response.partition(b"\r\n\r\n")
+    assert head.startswith(b"HTTP/1.1 200 OK")
+    assert b"Content-Length" not in head
+    assert body == b"data: 0\n\ndata: 1\n\ndata: 2\n\n"